@@ -13,10 +13,15 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import codecs
+import multiprocessing
 import re
 
 import urwid
 
+import assets
+import palette
+
 class ANSIParser(object):
     colors = [
         urwid.BLACK,
@@ -47,8 +52,9 @@ class ANSIParser(object):
         self.y = 0
         self.text_lines = []
         self.attr_lines = []
-        self.background = urwid.AttrSpec('light gray', 'black')
+        self.background = palette.attr('light gray', 'black')
         self.attr = self.background
+        self.seq = ''
         self.resetColor()
         self.moveTo(0,0)
 
@@ -150,7 +156,7 @@ class ANSIParser(object):
                 bg = self.bg256
             else:
                 bg = self.colors[self.bg]
-            self.attr = urwid.AttrSpec(', '.join(fgattrs), bg)
+            self.attr = palette.attr(', '.join(fgattrs), bg)
         if c == 'A':
             if not values:
                 values = [1]
@@ -165,7 +171,22 @@ class ANSIParser(object):
             self.moveTo(values[1]-1, values[0]-1)
 
     def parse(self, data):
-        seq = ''
+        self.feed(data)
+        return self.finish()
+
+    def parseFile(self, f):
+        """Parse UTF-8 ANSI art from a file a chunk at a time."""
+        decoder = codecs.getincrementaldecoder('utf8')()
+        while True:
+            chunk = f.read(assets.CHUNK_SIZE)
+            if not chunk:
+                break
+            self.feed(decoder.decode(chunk))
+        self.feed(decoder.decode('', True))
+        return self.finish()
+
+    def feed(self, data):
+        seq = self.seq
         for char in data:
             if seq:
                 seq += char
@@ -189,6 +210,9 @@ class ANSIParser(object):
                 self.attr_lines[self.y][self.x] = self.attr
                 x = self.x + 1
                 self.moveTo(x, self.y)
+        self.seq = seq
+
+    def finish(self):
         text = []
         current_attr = self.attr_lines[0][0]
         current_text = u''
@@ -196,8 +220,7 @@ class ANSIParser(object):
             for x in range(80):
                 char = self.text_lines[y][x]
                 attr = self.attr_lines[y][x]
-                if (attr.foreground_number != current_attr.foreground_number or
-                    attr.background_number != current_attr.background_number):
+                if attr is not current_attr:
                     text.append((current_attr, current_text))
                     current_attr = attr
                     current_text = u''
@@ -208,3 +231,58 @@ class ANSIParser(object):
         current_text = re.sub('\n+$', '\n', current_text)
         text.append((current_attr, current_text))
         return text
+
+def parse_compact(path):
+    """Parse the ANSI art in an asset into a compact, picklable frame.
+
+    The frame is a tuple of (foreground, background, text) with the
+    colors as strings, so it can be returned from another process;
+    expand() turns it into urwid markup.
+    """
+    f = assets.open_asset(path)
+    try:
+        text = ANSIParser().parseFile(f)
+    finally:
+        f.close()
+    return tuple([(attr.foreground, attr.background, chunk)
+                  for attr, chunk in text])
+
+def expand(frame):
+    # The attributes are interned, so frames share them.
+    return [(palette.attr(fg, bg), chunk) for fg, bg, chunk in frame]
+
+# Fewer frames than this are parsed in this process; starting the
+# pool would take longer than parsing them.
+PARALLEL_THRESHOLD = 8
+
+def load_frames(filenames, jobs=None):
+    """Parse the ANSI art in each of the files.
+
+    Returns urwid markup for each file.  The files are decompressed
+    into the parser as they are read (see assets.open_asset).  Files
+    with the same contents are parsed once and share their markup,
+    and when there are enough distinct frames they are parsed in a
+    pool of processes (jobs of them, or one per CPU if jobs is None)
+    which is shut down once they are done.
+    """
+    digests = []
+    unique = {}
+    for fn in filenames:
+        digest = assets.digest(fn)
+        digests.append(digest)
+        unique.setdefault(digest, fn)
+    keys = unique.keys()
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(keys))
+    if len(keys) >= PARALLEL_THRESHOLD and jobs > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            compact = pool.map(parse_compact, [unique[k] for k in keys])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        compact = [parse_compact(unique[k]) for k in keys]
+    frames = dict(zip(keys, [expand(frame) for frame in compact]))
+    return [frames[digest] for digest in digests]
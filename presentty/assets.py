@@ -0,0 +1,237 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import cStringIO as StringIO
+import hashlib
+import os
+import re
+import threading
+import zipfile
+import zlib
+
+CHUNK_SIZE = 65536
+
+NUMBER_RE = re.compile(r'(\d+)')
+
+class AssetError(IOError):
+    pass
+
+def natural_key(name):
+    # Sort frame9 before frame10.
+    return [int(part) if part.isdigit() else part
+            for part in NUMBER_RE.split(name)]
+
+def _import_lzma():
+    try:
+        import lzma
+    except ImportError:
+        try:
+            from backports import lzma
+        except ImportError:
+            return None
+    return lzma
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+class _Stream(object):
+    # A decompressing reader which closes the file under it as well.
+    def __init__(self, reader, raw):
+        self.reader = reader
+        self.raw = raw
+
+    def read(self, size=-1):
+        return self.reader.read(size)
+
+    def close(self):
+        try:
+            self.reader.close()
+        finally:
+            self.raw.close()
+
+class _GzipReader(object):
+    # gzip.GzipFile needs to seek in Python 2, which the members of zip
+    # archives can not, so decompress with zlib directly.
+    def __init__(self, f):
+        self.f = f
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.buffer = ''
+        self.eof = False
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            chunk = self.f.read(CHUNK_SIZE)
+            if not chunk:
+                self.buffer += self.decompressor.flush()
+                self.eof = True
+                break
+            data = self.decompressor.decompress(chunk)
+            while self.decompressor.unused_data:
+                # Another member follows
+                unused = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data += self.decompressor.decompress(unused)
+            self.buffer += data
+        if size < 0:
+            size = len(self.buffer)
+        data = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return data
+
+    def close(self):
+        self.buffer = ''
+
+def _decompress(f, name):
+    # Wrap the stream f in a decompressor chosen by name's extension.
+    lower = name.lower()
+    if lower.endswith('.gz'):
+        return _Stream(_GzipReader(f), f)
+    if lower.endswith('.xz') or lower.endswith('.lzma'):
+        lzma = _import_lzma()
+        if lzma is None:
+            f.close()
+            raise AssetError("Reading %s requires the lzma module" % name)
+        return _Stream(lzma.LZMAFile(f), f)
+    if lower.endswith('.zst'):
+        zstandard = _import_zstandard()
+        if zstandard is None:
+            f.close()
+            raise AssetError("Reading %s requires the zstandard module" %
+                             name)
+        return _Stream(zstandard.ZstdDecompressor().stream_reader(f), f)
+    return f
+
+def strip_compression(name):
+    """Return name without any compression suffix."""
+    root, ext = os.path.splitext(name)
+    if ext.lower() in ('.gz', '.xz', '.lzma', '.zst'):
+        return root
+    return name
+
+_archives = {}
+_archive_lock = threading.Lock()
+
+def _get_archive(path):
+    # Opening a member of a ZipFile made from a filename opens the
+    # file anew, so one ZipFile may be shared by threads; processes
+    # get their own.
+    key = (os.getpid(), path)
+    with _archive_lock:
+        archive = _archives.get(key)
+        if archive is None:
+            try:
+                archive = zipfile.ZipFile(path)
+            except zipfile.BadZipfile, e:
+                raise AssetError("%s: %s" % (path, e))
+            _archives[key] = archive
+    return archive
+
+def is_archive(path):
+    return path.lower().endswith('.zip') and os.path.isfile(path)
+
+def split_archive(path):
+    """Split path into (archive, member) if it names a member of a zip
+    archive, otherwise return (path, None)."""
+    if os.path.exists(path):
+        return (path, None)
+    parts = path.split(os.sep)
+    for i in range(len(parts) - 1, 0, -1):
+        archive = os.sep.join(parts[:i])
+        if is_archive(archive):
+            return (archive, '/'.join(parts[i:]))
+    return (path, None)
+
+def list_archive(path):
+    """Return the paths of the files in an archive in natural order."""
+    archive = _get_archive(path)
+    names = [name for name in archive.namelist()
+             if not name.endswith('/') and
+             not os.path.basename(name).startswith('.')]
+    return [os.path.join(path, name)
+            for name in sorted(names, key=natural_key)]
+
+def expand(paths):
+    """Replace any archives in paths with the files they contain."""
+    ret = []
+    for path in paths:
+        if is_archive(path):
+            ret.extend(list_archive(path))
+        else:
+            ret.append(path)
+    return ret
+
+def exists(path):
+    """Return whether path names a file, directory or archive member."""
+    archive, member = split_archive(path)
+    if member is None:
+        return os.path.exists(path)
+    try:
+        _get_archive(archive).getinfo(member)
+    except KeyError:
+        return False
+    return True
+
+def _open_raw(path):
+    archive, member = split_archive(path)
+    if member is None:
+        return open(path, 'rb')
+    try:
+        return _get_archive(archive).open(member)
+    except KeyError:
+        raise AssetError("There is no %s in %s" % (member, archive))
+
+def open_asset(path):
+    """Return a file-like object reading the contents of an asset.
+
+    The asset may be compressed with gzip (.gz), xz (.xz or .lzma) or
+    zstandard (.zst), and may be a member of a zip archive, named by
+    the path of the archive followed by the path within it
+    (frames.zip/001.ans).  The data are decompressed as they are read.
+    """
+    return _decompress(_open_raw(path), path)
+
+def open_seekable(path):
+    """Return something PIL can open: the path itself for an ordinary
+    file, otherwise a file-like object with the uncompressed data."""
+    archive, member = split_archive(path)
+    if member is None and strip_compression(path) == path:
+        return path
+    f = open_asset(path)
+    try:
+        return StringIO.StringIO(f.read())
+    finally:
+        f.close()
+
+def digest(path):
+    """Return a hash of the stored contents of an asset.
+
+    The file is read a chunk at a time.  Identical files compressed
+    differently hash differently; that only costs a duplicate parse.
+    """
+    h = hashlib.sha1()
+    f = _open_raw(path)
+    try:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            h.update(chunk)
+    finally:
+        f.close()
+    return h.digest()
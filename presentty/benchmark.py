@@ -0,0 +1,150 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import urwid
+
+import palette
+import rst
+import slide
+
+class FixedScreen(object):
+    # Stands in for the urwid screen for the ScreenHinter.
+    def __init__(self, size):
+        self.size = size
+
+    def get_cols_rows(self):
+        return self.size
+
+def bench_render(program, size, repeat):
+    """Render every slide from scratch and count layout requests.
+
+    Returns a list of (index, title, seconds per render, pack/rows
+    calls per render, of which computed).
+    """
+    results = []
+    for i, s in enumerate(program):
+        slide.LAYOUT_STATS.reset()
+        start = time.time()
+        for x in range(repeat):
+            # The slide keeps its final canvases, so discard those too.
+            urwid.CanvasCache.clear()
+            slide.invalidate_layout()
+            s._layouts.clear()
+            s.render(size)
+        elapsed = time.time() - start
+        results.append((i, s.title, elapsed / repeat,
+                        slide.LAYOUT_STATS.calls // repeat,
+                        slide.LAYOUT_STATS.computed // repeat))
+    return results
+
+# Modules which should only be loaded once a presentation needs them.
+LAZY_MODULES = ['PIL', 'presentty.image', 'presentty.text']
+
+IMPORT_SCRIPT = """
+import sys, time
+start = time.time()
+import %s
+elapsed = time.time() - start
+print elapsed
+print ' '.join([m for m in %r if m in sys.modules])
+"""
+
+def bench_import(module):
+    """Time a cold import of module in a fresh interpreter.
+
+    Returns (seconds, list of lazy modules which were loaded anyway).
+    """
+    env = os.environ.copy()
+    top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [top] + [p for p in [env.get('PYTHONPATH')] if p])
+    p = subprocess.Popen([sys.executable, '-c',
+                          IMPORT_SCRIPT % (module, LAZY_MODULES)],
+                         stdout=subprocess.PIPE, env=env)
+    out = p.communicate()[0]
+    if p.returncode:
+        raise Exception("Unable to import %s" % module)
+    elapsed, loaded = (out.split('\n') + [''])[:2]
+    return float(elapsed), loaded.split()
+
+def check_imports(budget):
+    """Check startup imports against a time budget (in seconds).
+
+    Returns True if every entry point imports within budget without
+    loading any of the lazy modules.
+    """
+    ok = True
+    for module in ['presentty.presentty', 'presentty.console']:
+        elapsed, loaded = bench_import(module)
+        status = 'ok'
+        if elapsed > budget or loaded:
+            status = 'FAIL'
+            ok = False
+        print '%-22s %10.3fms  %s' % (module, elapsed * 1000, status)
+        for name in loaded:
+            print '  loaded eagerly: %s' % name
+    return ok
+
+def main():
+    argp = argparse.ArgumentParser(description='Presentty benchmarks')
+    argp.add_argument('file', nargs='?', help='presentation file (RST)')
+    argp.add_argument('--size', default='80x25',
+                      help='screen size to render at (default: 80x25)')
+    argp.add_argument('--repeat', default=10, type=int,
+                      help='number of times to render each slide')
+    argp.add_argument('--no-layout-cache', dest='layout_cache',
+                      default=True, action='store_false',
+                      help='disable memoized slide layout for comparison')
+    argp.add_argument('--imports', dest='imports', action='store_true',
+                      help='check the startup import time instead')
+    argp.add_argument('--import-budget', dest='import_budget', default=0.5,
+                      type=float,
+                      help='maximum cold import time in seconds '
+                      '(default: 0.5)')
+    args = argp.parse_args()
+
+    if args.imports:
+        if not check_imports(args.import_budget):
+            sys.exit(1)
+        return
+    if not args.file:
+        argp.error('a presentation file is required')
+
+    size = tuple([int(x) for x in args.size.split('x')])
+    slide.layout_cache_enabled = args.layout_cache
+    hinter = slide.ScreenHinter(FixedScreen(size))
+    parser = rst.PresentationParser(palette.DARK_PALETTE, hinter)
+    program = parser.parse(unicode(open(args.file).read(), 'utf-8'),
+                           args.file)
+
+    print '%-4s %-30s %10s %8s %8s' % ('#', 'slide', 'ms/render',
+                                       'layout', 'computed')
+    total = 0.0
+    for i, title, elapsed, calls, computed in bench_render(
+            program, size, args.repeat):
+        total += elapsed
+        line = u'%-4i %-30s %10.3f %8i %8i' % (i, title[:30], elapsed * 1000,
+                                               calls, computed)
+        print line.encode('utf8')
+    print 'total: %.3fms' % (total * 1000)
+
+if __name__ == '__main__':
+    main()
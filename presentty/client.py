@@ -38,12 +38,38 @@ class Client(object):
             program.append(title)
         return program
 
+    def search(self, query):
+        """Return the indexes of the slides matching query, best first.
+
+        As in SearchIndex.search, the last word of the query is
+        matched as a prefix unless the query ends with a space.
+        """
+        if isinstance(query, unicode):
+            query = query.encode('utf-8')
+        terms = ' '.join(query.split())
+        if terms and query[-1:].isspace():
+            terms += ' '
+        self.file.write('search %s\n' % terms)
+        indexes = []
+        while True:
+            ln = self.file.readline().strip()
+            if ln == 'end':
+                break
+            indexes.append(int(ln.split(' ', 2)[1]))
+        return indexes
+
     def size(self):
         self.file.write('size\n')
         ln = self.file.readline().strip()
         x, cols, rows = ln.split(' ', 2)
         return (int(cols), int(rows))
 
+    def memory(self):
+        self.file.write('memory\n')
+        ln = self.file.readline().strip()
+        x, built, total, rss = ln.split(' ', 3)
+        return dict(built=int(built), total=int(total), rss=int(rss))
+
     def parseCurrent(self):
         ln = self.file.readline().strip()
         x, index, progressive_state, title = ln.split(' ', 3)
@@ -64,3 +90,21 @@ class Client(object):
     def prev(self):
         self.file.write('prev\n')
         return self.parseCurrent()
+
+    def stats(self):
+        self.file.write('stats\n')
+        ln = self.file.readline().strip()
+        x, fps, frame, slowest_name, slowest_time = ln.split(' ', 4)
+        ret = dict(fps=float(fps), frame=None, slowest=None, events={})
+        if frame != '-':
+            ret['frame'] = float(frame)
+        if slowest_name != '-':
+            ret['slowest'] = (slowest_name, float(slowest_time))
+        while True:
+            ln = self.file.readline().strip()
+            if ln == 'end':
+                break
+            x, name, count, total, high, last = ln.split(' ', 5)
+            ret['events'][name] = dict(count=int(count), total=float(total),
+                                       max=float(high), last=float(last))
+        return ret
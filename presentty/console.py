@@ -14,6 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import argparse
+import collections
 import sys
 import datetime
 import time
@@ -24,6 +25,7 @@ import palette
 import client
 import slide
 import rst
+import tools
 
 PALETTE = [
     ('reversed', 'standout', ''),
@@ -31,10 +33,11 @@ PALETTE = [
 ]
 
 class Row(urwid.Button):
-    def __init__(self, index, title, console):
+    def __init__(self, index, title, console, number_format='%-2i'):
         super(Row, self).__init__('', on_press=console.jump, user_data=index)
+        number = number_format % (index+1)
         col = urwid.Columns([
-                ('fixed', 3, urwid.Text('%-2i' % (index+1))),
+                ('fixed', len(number)+1, urwid.Text(number)),
                 urwid.Text(title),
                 ])
         self._w = urwid.AttrMap(col, None, focus_map='reversed')
@@ -42,6 +45,119 @@ class Row(urwid.Button):
     def selectable(self):
         return True
 
+class TitleIndex(object):
+    """Find slides by title as a filter is typed.
+
+    The titles are normalized once, when the index is made.  A slide
+    matches if each word of the query appears in its title, so the
+    matches for a query are among those for the query with its last
+    character removed; the results for each prefix of the latest
+    query are kept, and only they are searched when another
+    character is typed.
+    """
+
+    def __init__(self, titles):
+        self.titles = [self.normalize(title) for title in titles]
+        self.results = {u'': range(len(titles))}
+
+    @staticmethod
+    def normalize(text):
+        return u' '.join(text.lower().split())
+
+    def search(self, query):
+        """Return the indexes of the slides matching query, in order."""
+        query = self.normalize(query)
+        results = self._search(query)
+        # Only a query being typed or erased can use the others.
+        for key in self.results.keys():
+            if not query.startswith(key):
+                del self.results[key]
+        return results
+
+    def _search(self, query):
+        query = self.normalize(query)
+        results = self.results.get(query)
+        if results is None:
+            words = query.split()
+            results = [i for i in self._search(query[:-1])
+                       if all([word in self.titles[i] for word in words])]
+            self.results[query] = results
+        return results
+
+class SlideListWalker(urwid.ListWalker):
+    """The list of slides in the console, built as it is displayed.
+
+    Positions are slide indexes.  A Row is only made when the list box
+    displays it, and the most recently displayed are kept.  If a
+    filter is set, only the matching slides are listed, in the order
+    given (search results are ranked).
+    """
+
+    cache_size = 128
+
+    def __init__(self, console):
+        self.console = console
+        self.titles = []
+        self.shown = []
+        self.offsets = {}
+        self.rows = collections.OrderedDict()
+        self.number_format = '%-2i'
+        self.focus = 0
+
+    def setTitles(self, titles):
+        self.titles = titles
+        self.rows.clear()
+        self.number_format = '%%-%ii' % max(len(str(len(titles))), 2)
+        self.setShown(range(len(titles)))
+
+    def setShown(self, indexes):
+        """List only the slides at indexes, focusing the first."""
+        self.shown = indexes
+        self.offsets = dict([(index, offset)
+                             for offset, index in enumerate(indexes)])
+        if indexes:
+            self.focus = indexes[0]
+        self._modified()
+
+    def __len__(self):
+        return len(self.shown)
+
+    def __contains__(self, position):
+        return position in self.offsets
+
+    def __getitem__(self, position):
+        if position not in self:
+            raise IndexError(position)
+        row = self.rows.pop(position, None)
+        if row is None:
+            row = Row(position, self.titles[position], self.console,
+                      self.number_format)
+        self.rows[position] = row
+        while len(self.rows) > self.cache_size:
+            self.rows.popitem(last=False)
+        return row
+
+    def next_position(self, position):
+        offset = self.offsets[position] + 1
+        if offset >= len(self.shown):
+            raise IndexError(position)
+        return self.shown[offset]
+
+    def prev_position(self, position):
+        offset = self.offsets[position] - 1
+        if offset < 0:
+            raise IndexError(position)
+        return self.shown[offset]
+
+    def positions(self, reverse=False):
+        if reverse:
+            return reversed(self.shown)
+        return iter(self.shown)
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
 class Footer(urwid.WidgetWrap):
     def __init__(self):
         super(Footer, self).__init__(urwid.Columns([]))
@@ -63,11 +179,17 @@ class Screen(urwid.WidgetWrap):
         self.timer = 45*60
         self.size = (80, 25)
         self.timer_end = None
-        self.listbox = urwid.ListBox(urwid.SimpleFocusListWalker([]))
+        self.walker = SlideListWalker(console)
+        self.index = TitleIndex([])
+        self.filter = None
+        self.filter_mode = None
+        self.filter_text = urwid.Text(u'')
+        self.listbox = urwid.ListBox(self.walker)
+        self.list_frame = urwid.Frame(self.listbox)
         self.footer = Footer()
         footer = urwid.AttrMap(self.footer, 'status')
         self.left = urwid.Pile([])
-        self.left.contents.append((self.listbox, ('weight', 1)))
+        self.left.contents.append((self.list_frame, ('weight', 1)))
         self.left.set_focus(0)
 
         self.right = urwid.Pile([])
@@ -106,9 +228,70 @@ class Screen(urwid.WidgetWrap):
 
     def setProgram(self, program):
         self.program = program
-        self.listbox.body[:] = []
-        for i, s in enumerate(program):
-            self.listbox.body.append(Row(i, s.title, self.console))
+        titles = [s.title for s in program]
+        self.walker.setTitles(titles)
+        self.index = TitleIndex(titles)
+        if self.filter is not None:
+            self.setFilter(self.filter)
+
+    def startFilter(self, mode):
+        # The mode is 'title' to filter the list by title, or 'search'
+        # to list the results of a search of the slides' text, best
+        # first.
+        self.filter_mode = mode
+        self.list_frame.header = urwid.AttrMap(self.filter_text, 'status')
+        self.setFilter(u'')
+
+    def setFilter(self, query):
+        self.filter = query
+        if self.filter_mode == 'search':
+            prompt = u'search: '
+            if query.strip():
+                matches = self.console.search(query)
+            else:
+                matches = range(len(self.program))
+        else:
+            prompt = u'/'
+            matches = self.index.search(query)
+        self.walker.setShown(matches)
+        self.filter_text.set_text(u'%s%s  (%i of %i)' % (
+            prompt, query, len(matches), len(self.program)))
+
+    def endFilter(self):
+        self.filter = None
+        self.filter_mode = None
+        self.list_frame.header = None
+        self.walker.setShown(range(len(self.program)))
+        if 0 <= self.current < len(self.program):
+            self.walker.set_focus(self.current)
+
+    def filterKeypress(self, key):
+        # While a filter is being typed, printable keys add to it; the
+        # up and down keys still choose a slide from the matches.
+        if key == 'esc':
+            self.endFilter()
+        elif key == 'enter':
+            index = self.walker.focus
+            found = index in self.walker
+            self.endFilter()
+            if found:
+                self.console.jump(None, index)
+        elif key == 'backspace':
+            self.setFilter(self.filter[:-1])
+        elif key in ('up', 'down'):
+            try:
+                if key == 'up':
+                    position = self.walker.prev_position(self.walker.focus)
+                else:
+                    position = self.walker.next_position(self.walker.focus)
+            except (IndexError, KeyError):
+                return None
+            self.walker.set_focus(position)
+        elif len(key) == 1 and key >= u' ':
+            self.setFilter(self.filter + key)
+        else:
+            return key
+        return None
 
     def setSize(self, size):
         self.size = size
@@ -126,8 +309,8 @@ class Screen(urwid.WidgetWrap):
         changed = False
         if index != self.current:
             self.current = index
-            self.listbox.set_focus(index)
-            self.listbox._invalidate()
+            if self.filter is None:
+                self.listbox.set_focus(index)
             self.footer.position.set_text('%i / %i' % (index+1, len(self.program)))
             changed = True
         if progressive_state != self.progressive_state:
@@ -160,7 +343,15 @@ class Screen(urwid.WidgetWrap):
             self.timer_end = now + self.timer
 
     def keypress(self, size, key):
-        if key in (' ', 'x'):
+        if self.filter is not None:
+            key = self.filterKeypress(key)
+            if key is None:
+                return None
+        if key == '/':
+            self.startFilter('title')
+        elif key == 's':
+            self.startFilter('search')
+        elif key in (' ', 'x'):
             self.startStopTimer()
         elif key == 'page up':
             self.console.prev()
@@ -219,8 +410,9 @@ class TimerDialog(urwid.WidgetWrap):
 class Console(object):
     poll_interval = 0.5
 
-    def __init__(self, program):
+    def __init__(self, program, hinter=None):
         self.screen = Screen(self)
+        self.hinter = hinter
         self.loop = urwid.MainLoop(self.screen, palette=PALETTE)
         self.client = client.Client()
         self.screen.setProgram(program)
@@ -230,6 +422,9 @@ class Console(object):
     def run(self):
         self.loop.run()
 
+    def search(self, query):
+        return self.client.search(query)
+
     def jump(self, widget, index):
         self.screen.setCurrent(self.client.jump(index))
 
@@ -244,7 +439,11 @@ class Console(object):
         self.loop.set_alarm_in(self.poll_interval, self.updateCallback)
 
     def update(self):
-        self.screen.setSize(self.client.size())
+        size = self.client.size()
+        if size != self.screen.size:
+            self.screen.setSize(size)
+            if self.hinter:
+                self.hinter.resized()
         self.screen.setCurrent(self.client.current())
 
     def timerDialog(self):
@@ -279,6 +478,7 @@ def main():
                         default=False,
                         action='store_true',
                         help='use a black on white palette')
+    rst.add_jobs_argument(parser)
     parser.add_argument('file',
                         help='presentation file (RST)')
     args = parser.parse_args()
@@ -287,8 +487,13 @@ def main():
     else:
         plt = palette.DARK_PALETTE
     hinter = slide.ScreenHinter()
-    parser = rst.PresentationParser(plt, hinter)
-    program = parser.parse(open(args.file).read())
-    c = Console(program)
+    parser = rst.PresentationParser(plt, hinter, jobs=args.jobs)
+    program = parser.parse(unicode(open(args.file).read(), 'utf-8'),
+                           args.file)
+    failures = tools.runner.getSummary()
+    if failures:
+        print failures.encode('utf8')
+        raw_input("Press ENTER to continue.")
+    c = Console(program, hinter)
     hinter.setScreen(c.screen)
     c.run()
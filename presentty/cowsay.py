@@ -0,0 +1,153 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import codecs
+import os
+import re
+import textwrap
+import threading
+
+DEFAULT_COW = 'default'
+DEFAULT_WIDTH = 40
+
+COW_PATH = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cows'),
+    '/usr/share/cowsay/cows',
+    '/usr/share/cows',
+    '/usr/local/share/cows',
+    '/usr/local/share/cowsay/cows',
+]
+
+HEREDOC_RE = re.compile(r'\$the_cow\s*=\s*<<\s*(["\']?)(\w+)\1\s*;')
+VARIABLE_RE = re.compile(r'\\(.)|\$\{?(\w+)\}?')
+
+class CowError(Exception):
+    pass
+
+class Cow(object):
+    """A cowfile parsed into a template.
+
+    Cowfiles are perl; only the $the_cow here-document is used.  It
+    is split once into literal text and the names of the variables
+    ($eyes, $tongue and $thoughts) to substitute when rendering.
+    """
+
+    def __init__(self, name, data):
+        self.name = name
+        self.parts = self._parse(data)
+
+    def _parse(self, data):
+        m = HEREDOC_RE.search(data)
+        if not m:
+            raise CowError("%s is not a cowfile" % self.name)
+        quote, terminator = m.groups()
+        lines = []
+        for line in data[m.end():].split('\n')[1:]:
+            if line.rstrip('\r') == terminator:
+                break
+            lines.append(line.rstrip('\r'))
+        body = u'\n'.join(lines) + u'\n'
+        if quote == "'":
+            return [body]
+        parts = []
+        pos = 0
+        for m in VARIABLE_RE.finditer(body):
+            literal = body[pos:m.start()]
+            escaped, variable = m.groups()
+            if escaped is not None:
+                literal += escaped
+            if literal:
+                if parts and not isinstance(parts[-1], tuple):
+                    parts[-1] += literal
+                else:
+                    parts.append(literal)
+            if variable is not None:
+                parts.append((variable,))
+            pos = m.end()
+        parts.append(body[pos:])
+        return parts
+
+    def render(self, eyes='oo', tongue='  ', thoughts='\\'):
+        values = {'eyes': eyes, 'tongue': tongue, 'thoughts': thoughts}
+        return u''.join([values.get(p[0], u'') if isinstance(p, tuple)
+                         else p for p in self.parts])
+
+def balloon(text, width=DEFAULT_WIDTH):
+    """Wrap text in a speech balloon the way cowsay does."""
+    # Like perl's Text::Wrap, lines are at most width - 1 columns.
+    lines = textwrap.wrap(u' '.join(text.split()), max(width - 1, 1))
+    if not lines:
+        lines = [u'']
+    longest = max([len(l) for l in lines])
+    if len(lines) < 2:
+        borders = [(u'<', u'>')]
+    else:
+        borders = ([(u'/', u'\\')] + [(u'|', u'|')] * (len(lines) - 2) +
+                   [(u'\\', u'/')])
+    out = [u' ' + u'_' * (longest + 2)]
+    for (left, right), line in zip(borders, lines):
+        out.append(u'%s %s %s' % (left, line.ljust(longest), right))
+    out.append(u' ' + u'-' * (longest + 2))
+    return u'\n'.join(out) + u'\n'
+
+_cow_cache = {}
+_cow_lock = threading.Lock()
+
+def find_cow(name):
+    if os.sep in name:
+        if os.path.exists(name):
+            return name
+        return None
+    if not name.endswith('.cow'):
+        name += '.cow'
+    path = COW_PATH
+    if os.environ.get('COWPATH'):
+        path = os.environ['COWPATH'].split(os.pathsep) + path
+    for d in path:
+        fn = os.path.join(d, name)
+        if os.path.exists(fn):
+            return fn
+    return None
+
+def get_cow(name=None):
+    """Return the named cow, parsing its cowfile only the first time."""
+    name = name or DEFAULT_COW
+    with _cow_lock:
+        cow = _cow_cache.get(name)
+        if cow is None:
+            fn = find_cow(name)
+            if fn is None:
+                raise CowError("Unable to find cowfile %s" % name)
+            with codecs.open(fn, 'r', 'utf-8', 'replace') as f:
+                cow = Cow(name, f.read())
+            _cow_cache[name] = cow
+    return cow
+
+def render(text, cow=None, width=None):
+    cow = get_cow(cow)
+    return balloon(text, width or DEFAULT_WIDTH) + cow.render()
+
+def main():
+    import argparse
+    argp = argparse.ArgumentParser(description='Render cowsay text')
+    argp.add_argument('-f', dest='cow', help='cowfile name or path')
+    argp.add_argument('-W', dest='width', default=DEFAULT_WIDTH, type=int,
+                      help='balloon width (default: %s)' % DEFAULT_WIDTH)
+    argp.add_argument('text', nargs='+', help='text to say')
+    args = argp.parse_args()
+    print render(u' '.join(args.text), args.cow, args.width).encode('utf8'),
+
+if __name__ == '__main__':
+    main()
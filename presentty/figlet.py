@@ -0,0 +1,343 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import codecs
+import os
+import threading
+
+DEFAULT_FONT = 'standard'
+
+FONT_PATH = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts'),
+    '/usr/share/figlet',
+    '/usr/local/share/figlet',
+    '/usr/share/figlet/fonts',
+]
+
+# Horizontal layout bits from the FIGfont header.
+SM_EQUAL = 1
+SM_LOWLINE = 2
+SM_HIERARCHY = 4
+SM_PAIR = 8
+SM_BIGX = 16
+SM_HARDBLANK = 32
+SM_KERN = 64
+SM_SMUSH = 128
+
+# Characters which every FIGfont must define after ASCII.
+DEUTSCH = [196, 214, 220, 228, 246, 252, 223]
+
+HIERARCHY = ['|', '/\\', '[]', '{}', '()', '<>']
+PAIRS = {'[]': '|', '][': '|', '{}': '|', '}{': '|',
+         '()': '|', ')(': '|'}
+BIGX = {'/\\': '|', '\\/': 'Y', '><': 'X'}
+
+class FontError(Exception):
+    pass
+
+class Font(object):
+    """A FIGfont loaded into a table of glyphs.
+
+    Each glyph is a tuple of rows (with hardblanks intact) along with
+    its width, so rendering only needs dictionary lookups.
+    """
+
+    def __init__(self, name, data):
+        self.name = name
+        self.glyphs = {}
+        self._load(data)
+
+    def _load(self, data):
+        lines = data.splitlines()
+        header = lines[0].split()
+        if not header or not header[0].startswith('flf2a'):
+            raise FontError("%s is not a FIGlet font" % self.name)
+        try:
+            self.hardblank = header[0][5]
+            self.height = int(header[1])
+            old_layout = int(header[4])
+            comments = int(header[5])
+            if len(header) > 7:
+                layout = int(header[7])
+            elif old_layout == 0:
+                layout = SM_KERN
+            elif old_layout < 0:
+                layout = 0
+            else:
+                layout = (old_layout & 31) | SM_SMUSH
+        except (IndexError, ValueError):
+            raise FontError("%s has an invalid header" % self.name)
+        self.layout = layout
+        pos = 1 + comments
+        codes = range(32, 127) + DEUTSCH
+        for code in codes:
+            if pos + self.height > len(lines):
+                break
+            self._addGlyph(code, lines[pos:pos + self.height])
+            pos += self.height
+        # Code-tagged characters follow the required ones.
+        while pos + self.height < len(lines):
+            tag = lines[pos].split()
+            pos += 1
+            try:
+                code = int(tag[0], 0)
+            except (IndexError, ValueError):
+                break
+            self._addGlyph(code, lines[pos:pos + self.height])
+            pos += self.height
+
+    def _addGlyph(self, code, lines):
+        rows = []
+        for line in lines:
+            line = line.rstrip()
+            if line:
+                end = line[-1]
+                line = line.rstrip(end)
+            rows.append(line)
+        self.glyphs[code] = (tuple(rows), len(rows[0]))
+
+    def getGlyph(self, char):
+        glyph = self.glyphs.get(ord(char))
+        if glyph is None:
+            glyph = self.glyphs.get(0)
+        return glyph
+
+    def _smushChars(self, left, right, left_width, right_width):
+        # Returns the character resulting from overlapping left and
+        # right, or None if they may not be overlapped.
+        if left == ' ':
+            return right
+        if right == ' ':
+            return left
+        if left_width < 2 or right_width < 2:
+            return None
+        layout = self.layout
+        if not layout & SM_SMUSH:
+            return None
+        if not layout & 63:
+            # Universal smushing
+            if left == self.hardblank:
+                return right
+            if right == self.hardblank:
+                return left
+            return right
+        hardblank = self.hardblank
+        if layout & SM_HARDBLANK:
+            if left == hardblank and right == hardblank:
+                return left
+        if left == hardblank or right == hardblank:
+            return None
+        if layout & SM_EQUAL and left == right:
+            return left
+        if layout & SM_LOWLINE:
+            if left == '_' and right in '|/\\[]{}()<>':
+                return right
+            if right == '_' and left in '|/\\[]{}()<>':
+                return left
+        if layout & SM_HIERARCHY:
+            for i, chars in enumerate(HIERARCHY):
+                above = ''.join(HIERARCHY[i + 1:])
+                if left in chars and right in above:
+                    return right
+                if right in chars and left in above:
+                    return left
+        if layout & SM_PAIR and left + right in PAIRS:
+            return PAIRS[left + right]
+        if layout & SM_BIGX and left + right in BIGX:
+            return BIGX[left + right]
+        return None
+
+    def _smushAmount(self, rows, length, glyph, prev_width):
+        glyph_rows, width = glyph
+        if not self.layout & (SM_SMUSH | SM_KERN):
+            return 0
+        amount = width
+        for row, glyph_row in zip(rows, glyph_rows):
+            trimmed = row.rstrip(' ')
+            line_edge = max(len(trimmed) - 1, 0)
+            left = row[line_edge] if row else ''
+            char_edge = len(glyph_row) - len(glyph_row.lstrip(' '))
+            right = glyph_row[char_edge:char_edge + 1]
+            amt = char_edge + length - 1 - line_edge
+            if not left or left == ' ':
+                amt += 1
+            elif right:
+                if self._smushChars(left, right, prev_width,
+                                    width) is not None:
+                    amt += 1
+            amount = min(amount, amt)
+        return amount
+
+    def _addChar(self, rows, length, prev_width, glyph, limit):
+        # Returns the new rows, or None if the glyph does not fit.
+        glyph_rows, width = glyph
+        amount = self._smushAmount(rows, length, glyph, prev_width)
+        if length + width - amount > limit:
+            return None
+        new_rows = []
+        for row, glyph_row in zip(rows, glyph_rows):
+            row = list(row)
+            for k in range(amount):
+                column = length - amount + k
+                if column < 0:
+                    continue
+                char = self._smushChars(row[column], glyph_row[k],
+                                        prev_width, width)
+                if char is not None:
+                    row[column] = char
+            new_rows.append(u''.join(row) + glyph_row[amount:])
+        return new_rows
+
+    def _renderLine(self, line, limit, final):
+        # This follows the word breaking in figlet's main loop: a line
+        # which overflows is broken at its last space when it has one,
+        # and spaces at the start of a continuation line are dropped.
+        out = []
+        current = _Line(self, limit)
+        mode = 0
+        for char in line:
+            while True:
+                retry = False
+                if mode == -1:
+                    if char == ' ':
+                        break
+                    mode = 0
+                if current.add(char):
+                    if char != ' ':
+                        mode = 3 if mode >= 2 else 1
+                    else:
+                        mode = 2 if mode > 0 else 0
+                elif not current.length:
+                    # A single glyph wider than the line is clipped.
+                    glyph_rows = self.getGlyph(char)[0]
+                    out.extend([row[:limit] for row in glyph_rows])
+                    mode = -1
+                elif char == ' ':
+                    if mode == 2:
+                        current.split(out)
+                    else:
+                        current.flush(out)
+                    mode = -1
+                else:
+                    if mode >= 2:
+                        current.split(out)
+                    else:
+                        current.flush(out)
+                    mode = 1 if mode == 3 else 0
+                    retry = True
+                if not retry:
+                    break
+        if current.length or not final:
+            current.flush(out)
+        return out
+
+    def render(self, text, width=80):
+        """Render text as figlet would for a terminal of the given width."""
+        rows = []
+        lines = text.split('\n')
+        for i, line in enumerate(lines):
+            rows.extend(self._renderLine(line, width - 1,
+                                         i == len(lines) - 1))
+        return u''.join([row.replace(self.hardblank, u' ') + u'\n'
+                         for row in rows])
+
+class _Line(object):
+    # One line of output being assembled.
+    def __init__(self, font, limit):
+        self.font = font
+        self.limit = limit
+        self.clear()
+
+    def clear(self):
+        self.rows = [u''] * self.font.height
+        self.length = 0
+        self.prev_width = 0
+        self.chars = []
+
+    def add(self, char):
+        glyph = self.font.getGlyph(char)
+        if glyph is None:
+            return True
+        rows = self.font._addChar(self.rows, self.length, self.prev_width,
+                                  glyph, self.limit)
+        if rows is None:
+            return False
+        self.rows = rows
+        self.length = len(rows[0])
+        self.prev_width = glyph[1]
+        self.chars.append(char)
+        return True
+
+    def flush(self, out):
+        out.extend(self.rows)
+        self.clear()
+
+    def split(self, out):
+        # Break the line at its last run of spaces.
+        chars = self.chars
+        last = len(chars) - 1 - chars[::-1].index(' ')
+        end = last
+        while end > 0 and chars[end - 1] == ' ':
+            end -= 1
+        self.clear()
+        for char in chars[:end]:
+            self.add(char)
+        self.flush(out)
+        for char in chars[last + 1:]:
+            self.add(char)
+
+_font_cache = {}
+_font_lock = threading.Lock()
+
+def find_font(name):
+    if os.sep in name or name.endswith('.flf'):
+        if os.path.exists(name):
+            return name
+        return None
+    for path in FONT_PATH:
+        fn = os.path.join(path, name + '.flf')
+        if os.path.exists(fn):
+            return fn
+    return None
+
+def get_font(name=None):
+    """Return the named font, loading it only the first time."""
+    name = name or DEFAULT_FONT
+    with _font_lock:
+        font = _font_cache.get(name)
+        if font is None:
+            fn = find_font(name)
+            if fn is None:
+                raise FontError("Unable to find figlet font %s" % name)
+            with codecs.open(fn, 'r', 'latin-1') as f:
+                font = Font(name, f.read())
+            _font_cache[name] = font
+    return font
+
+def render(text, font=None, width=80):
+    return get_font(font).render(text, width)
+
+def main():
+    import argparse
+    argp = argparse.ArgumentParser(description='Render FIGlet text')
+    argp.add_argument('-f', dest='font', help='font name or file')
+    argp.add_argument('-w', dest='width', default=80, type=int,
+                      help='output width (default: 80)')
+    argp.add_argument('text', nargs='+', help='text to render')
+    args = argp.parse_args()
+    print render(u' '.join(args.text), args.font, args.width).encode('utf8'),
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import base64
+import collections
+import cStringIO as StringIO
+import fcntl
+import os
+import struct
+import sys
+import termios
+import threading
+import weakref
+
+import urwid
+
+KITTY = 'kitty'
+SIXEL = 'sixel'
+BACKENDS = (KITTY, SIXEL)
+
+DEFAULT_CELL_SIZE = (10, 20)
+KITTY_CHUNK = 4096
+KITTY_CLEAR = '\x1b_Ga=d,d=a,q=2\x1b\\'
+
+def detect(environ=None):
+    """Guess which inline graphics protocol the terminal supports."""
+    if environ is None:
+        environ = os.environ
+    term = environ.get('TERM', '')
+    program = environ.get('TERM_PROGRAM', '')
+    if environ.get('KITTY_WINDOW_ID') or term == 'xterm-kitty':
+        return KITTY
+    if program == 'ghostty' or term == 'xterm-ghostty':
+        return KITTY
+    if program in ('WezTerm', 'iTerm.app'):
+        return SIXEL
+    if term.startswith(('mlterm', 'foot', 'yaft', 'contour')):
+        return SIXEL
+    if 'sixel' in term:
+        return SIXEL
+    return None
+
+def _sixel_run(char, count):
+    if count > 3:
+        return '!%i%s' % (count, char)
+    return char * count
+
+def encode_sixel(image, colors=255):
+    """Encode a PIL image as a DEC sixel sequence."""
+    image = image.convert('RGB').quantize(colors)
+    width, height = image.size
+    pixels = list(image.getdata())
+    palette = image.getpalette()
+    out = ['\x1bP0;1;0q', '"1;1;%i;%i' % (width, height)]
+    for index in sorted(set(pixels)):
+        r, g, b = palette[index * 3:index * 3 + 3]
+        out.append('#%i;2;%i;%i;%i' % (index, r * 100 // 255,
+                                       g * 100 // 255, b * 100 // 255))
+    for top in range(0, height, 6):
+        # For each color in this band of six rows, the bits set in
+        # each column where it appears.
+        band = collections.defaultdict(dict)
+        for bit in range(min(6, height - top)):
+            row = pixels[(top + bit) * width:(top + bit + 1) * width]
+            for x, index in enumerate(row):
+                columns = band[index]
+                columns[x] = columns.get(x, 0) | (1 << bit)
+        lines = []
+        for index in sorted(band):
+            line = ['#%i' % index]
+            last = None
+            count = 0
+            x = 0
+            for column in sorted(band[index]):
+                if column > x:
+                    if last is not None:
+                        line.append(_sixel_run(last, count))
+                    last, count = '?', column - x
+                char = chr(63 + band[index][column])
+                if char == last:
+                    count += 1
+                else:
+                    if last is not None:
+                        line.append(_sixel_run(last, count))
+                    last, count = char, 1
+                x = column + 1
+            if last is not None:
+                line.append(_sixel_run(last, count))
+            lines.append(''.join(line))
+        out.append('$'.join(lines))
+        out.append('-')
+    out.append('\x1b\\')
+    return ''.join(out)
+
+def encode_kitty(image, image_id):
+    """Encode a PIL image as kitty graphics commands transmitting it
+    (without displaying it) under the given id."""
+    buf = StringIO.StringIO()
+    image.convert('RGB').save(buf, 'PNG')
+    data = base64.b64encode(buf.getvalue())
+    chunks = [data[i:i + KITTY_CHUNK]
+              for i in range(0, len(data), KITTY_CHUNK)] or ['']
+    out = []
+    for i, chunk in enumerate(chunks):
+        more = int(i < len(chunks) - 1)
+        if i == 0:
+            out.append('\x1b_Ga=t,f=100,i=%i,q=2,m=%i;%s\x1b\\' %
+                       (image_id, more, chunk))
+        else:
+            out.append('\x1b_Gm=%i;%s\x1b\\' % (more, chunk))
+    return ''.join(out)
+
+def kitty_place(image_id, cols, rows):
+    """Display a transmitted image over cols x rows cells at the cursor."""
+    return '\x1b_Ga=p,i=%i,c=%i,r=%i,C=1,q=2\x1b\\' % (image_id, cols, rows)
+
+class PayloadCache(object):
+    """Keep the most recently used encoded images."""
+
+    def __init__(self, size=32):
+        self.size = size
+        self.lock = threading.Lock()
+        self.payloads = collections.OrderedDict()
+
+    def get(self, key, encode):
+        with self.lock:
+            payload = self.payloads.pop(key, None)
+        if payload is None:
+            payload = encode()
+        with self.lock:
+            self.payloads[key] = payload
+            while len(self.payloads) > self.size:
+                self.payloads.popitem(last=False)
+        return payload
+
+    def clear(self):
+        with self.lock:
+            self.payloads.clear()
+
+payloads = PayloadCache()
+
+# Canvases rendered by images in place of their pixels, mapped to
+# (image widget, left, top, cols, rows) of the area the image covers.
+_placeholders = weakref.WeakKeyDictionary()
+
+def register(canvas, source, left, top, cols, rows):
+    """Mark a region of canvas to be covered by source's image.
+
+    The source must provide a key and getImage(width, height).
+    """
+    _placeholders[canvas] = (source, left, top, cols, rows)
+
+def find_placements(canvas):
+    """Return where images appear on a screen canvas.
+
+    Returns a list of (col, row, source, cols, rows) for each
+    registered image which is entirely visible.  Images which are cut
+    off (by an overlay or a transition in progress, for instance) are
+    left to their placeholder cells.
+    """
+    placements = []
+    if not _placeholders:
+        return placements
+    shards = getattr(canvas, 'shards', None)
+    if shards is None:
+        shards = [(canvas.rows(), [(0, 0, canvas.cols(), canvas.rows(),
+                                    None, canvas)])]
+    row = 0
+    shard_tail = []
+    for num_rows, cviews in shards:
+        sbody = urwid.canvas.shard_body(cviews, shard_tail, False)
+        col = 0
+        for done_rows, content_iter, cview in sbody:
+            trim_left, trim_top, cols, rows, attr_map, canv = cview[:6]
+            if not done_rows and canv in _placeholders:
+                source, left, top, width, height = _placeholders[canv]
+                if (left >= trim_left and top >= trim_top and
+                    left + width <= trim_left + cols and
+                    top + height <= trim_top + rows):
+                    placements.append((col + left - trim_left,
+                                       row + top - trim_top,
+                                       source, width, height))
+            col += cols
+        shard_tail = urwid.canvas.shard_body_tail(num_rows, sbody)
+        row += num_rows
+    return placements
+
+def get_cell_size(fileno=None):
+    """Return the size of a character cell in pixels."""
+    if fileno is None:
+        fileno = sys.stdout.fileno()
+    try:
+        buf = fcntl.ioctl(fileno, termios.TIOCGWINSZ, '\0' * 8)
+        rows, cols, xpixels, ypixels = struct.unpack('HHHH', buf)
+    except (IOError, OSError, struct.error):
+        return DEFAULT_CELL_SIZE
+    if not (rows and cols and xpixels and ypixels):
+        return DEFAULT_CELL_SIZE
+    return (xpixels // cols, ypixels // rows)
+
+class GraphicsManager(object):
+    """Draw images with an inline graphics protocol after each frame.
+
+    Call prepare() with the canvas before it is drawn and emit() after
+    the screen has drawn it.  Encoded images are cached per image and
+    size, so redraws only replay them.
+    """
+
+    def __init__(self, backend, cache=None):
+        self.backend = backend
+        self.cache = cache or payloads
+        self.cell_size = DEFAULT_CELL_SIZE
+        self.placed = []
+        self.pending = []
+        self.kitty_ids = {}
+        self.transmitted = set()
+
+    def _key(self, placements):
+        return [(c, r, id(s), w, h) for (c, r, s, w, h) in placements]
+
+    def prepare(self, screen, canvas):
+        self.pending = find_placements(canvas)
+        if (self.backend == SIXEL and self.placed and
+            self._key(self.placed) != self._key(self.pending)):
+            # Sixel pixels stay until the cells under them are redrawn.
+            screen.clear()
+        if self.pending:
+            try:
+                fileno = screen._term_output_file.fileno()
+            except AttributeError:
+                fileno = None
+            self.cell_size = get_cell_size(fileno)
+
+    def getPayload(self, source, cols, rows):
+        width = cols * self.cell_size[0]
+        height = rows * self.cell_size[1]
+        key = (self.backend, source.key, width, height)
+        if self.backend == SIXEL:
+            return self.cache.get(
+                key, lambda: encode_sixel(source.getImage(width, height)))
+        image_id = self.kitty_ids.get(key)
+        if image_id is None:
+            image_id = self.kitty_ids[key] = len(self.kitty_ids) + 1
+        return self.cache.get(
+            key, lambda: encode_kitty(source.getImage(width, height),
+                                      image_id)), image_id
+
+    def render(self):
+        """Return the bytes to write for the pending placements."""
+        out = []
+        if self.backend == KITTY and (self.placed or self.pending):
+            out.append(KITTY_CLEAR)
+        if self.pending:
+            out.append('\x1b7')
+        for col, row, source, cols, rows in self.pending:
+            out.append('\x1b[%i;%iH' % (row + 1, col + 1))
+            if self.backend == SIXEL:
+                out.append(self.getPayload(source, cols, rows))
+            else:
+                payload, image_id = self.getPayload(source, cols, rows)
+                if image_id not in self.transmitted:
+                    out.append(payload)
+                    self.transmitted.add(image_id)
+                out.append(kitty_place(image_id, cols, rows))
+        if self.pending:
+            out.append('\x1b8')
+        self.placed = self.pending
+        return ''.join(out)
+
+    def emit(self, screen):
+        data = self.render()
+        if data:
+            screen.write(data)
+            screen.flush()
@@ -0,0 +1,213 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import threading
+
+# Parts of token type names which are not styled.  docutils leaves
+# out the first three, and the last would only hide the string and
+# number styles.
+UNSTYLED = ('token', 'text', '', 'literal')
+
+class LexerError(Exception):
+    pass
+
+class TokenMap(object):
+    """Palette attributes for pygments token types.
+
+    A token gets the attribute of the longest prefix of its type which
+    is in the palette; Token.Name.Builtin.Pseudo tries
+    'name-builtin-pseudo', then 'name-builtin' and then 'name'.  The
+    standard types are looked up when the map is made and any others
+    the first time they are seen.
+    """
+
+    def __init__(self, palette):
+        import pygments.token
+        self.palette = palette
+        self.attrs = {}
+        for ttype in pygments.token.STANDARD_TYPES:
+            self.get(ttype)
+
+    def get(self, ttype):
+        try:
+            return self.attrs[ttype]
+        except KeyError:
+            pass
+        classes = [c for c in str(ttype).lower().split('.')
+                   if c not in UNSTYLED]
+        attr = None
+        for length in range(len(classes), 0, -1):
+            attr = self.palette.get('-'.join(classes[:length]))
+            if attr is not None:
+                break
+        self.attrs[ttype] = attr
+        return attr
+
+_token_maps = {}
+_lexers = {}
+_lock = threading.Lock()
+
+def get_token_map(palette):
+    """Return the TokenMap for a palette, making it the first time."""
+    with _lock:
+        # Keep the palette so that its id is not reused.
+        entry = _token_maps.get(id(palette))
+        if entry is None:
+            entry = _token_maps[id(palette)] = (palette, TokenMap(palette))
+    return entry[1]
+
+def get_lexer(language):
+    """Return a pygments lexer for language, or None for plain text.
+
+    Raises LexerError (with the same messages as docutils) if the
+    language can not be highlighted.
+    """
+    if language in ('', 'text'):
+        return None
+    with _lock:
+        if language in _lexers:
+            return _lexers[language]
+    try:
+        import pygments.lexers
+        import pygments.util
+    except ImportError:
+        raise LexerError('Cannot analyze code. Pygments package not found.')
+    try:
+        lexer = pygments.lexers.get_lexer_by_name(language)
+    except pygments.util.ClassNotFound:
+        raise LexerError('Cannot analyze code. '
+                         'No Pygments lexer found for "%s".' % language)
+    with _lock:
+        _lexers[language] = lexer
+    return lexer
+
+def _tokens(code, lexer):
+    # Like docutils, merge runs of the same type and drop the newline
+    # pygments adds at the end.
+    import pygments
+    if lexer is None:
+        yield (None, code)
+        return
+    tokens = pygments.lex(code, lexer)
+    lasttype, lastval = next(tokens)
+    for ttype, value in tokens:
+        if ttype is lasttype:
+            lastval += value
+        else:
+            yield (lasttype, lastval)
+            lasttype, lastval = ttype, value
+    if lastval.endswith('\n'):
+        lastval = lastval[:-1]
+    if lastval:
+        yield (lasttype, lastval)
+
+def _numberLines(tokens, startline, endline):
+    fmt = '%%%dd ' % len(str(endline))
+    lineno = startline
+    yield (None, fmt % lineno)
+    for ttype, value in tokens:
+        lines = value.split('\n')
+        for line in lines[:-1]:
+            yield (ttype, line + '\n')
+            lineno += 1
+            yield (None, fmt % lineno)
+        yield (ttype, lines[-1])
+
+def highlight(code, language, palette, startline=None):
+    """Return urwid markup for code highlighted in the palette's colors.
+
+    If startline is given, lines are numbered from it.
+    """
+    token_map = get_token_map(palette)
+    tokens = _tokens(code, get_lexer(language))
+    if startline is not None:
+        tokens = _numberLines(tokens, startline,
+                              startline + code.count('\n') + 1)
+    markup = []
+    last = None
+    for ttype, value in tokens:
+        if not value:
+            continue
+        attr = None
+        if ttype is not None:
+            attr = token_map.get(ttype)
+        if markup and attr is last:
+            if attr is None:
+                markup[-1] += value
+            else:
+                markup[-1] = (attr, markup[-1][1] + value)
+        elif attr is None:
+            markup.append(value)
+        else:
+            markup.append((attr, value))
+        last = attr
+    return markup
+
+def compact(markup):
+    """Return markup with attributes replaced by their colors, so that
+    it can be pickled."""
+    return [(item[0].foreground, item[0].background, item[1])
+            if isinstance(item, tuple) else item for item in markup]
+
+def expand(markup):
+    # The reverse of compact(), interning the attributes.
+    import palette
+    return [(palette.attr(item[0], item[1]), item[2])
+            if isinstance(item, tuple) else item for item in markup]
+
+class HighlightCache(object):
+    """Keep the most recently highlighted code blocks.
+
+    Entries are keyed by the code, language, palette and line numbering,
+    so a slide that is rebuilt (or code repeated across slides) is not
+    tokenized again.  The markup returned is shared and must not be
+    modified.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, code, language, palette, startline=None):
+        key = (code, language, id(palette), startline)
+        with self.lock:
+            markup = self.entries.pop(key, None)
+            if markup is not None:
+                self.hits += 1
+                self.entries[key] = markup
+                return markup
+            self.misses += 1
+        markup = highlight(code, language, palette, startline)
+        self.put(code, language, palette, startline, markup)
+        return markup
+
+    def put(self, code, language, palette, startline, markup):
+        """Add markup highlighted elsewhere (in another process)."""
+        key = (code, language, id(palette), startline)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = markup
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+cache = HighlightCache()
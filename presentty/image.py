@@ -13,15 +13,26 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import subprocess
+import cStringIO as StringIO
 import HTMLParser
+import os
+import Queue
 import re
+import threading
+import time
 
 import PIL
 import PIL.ExifTags
+import PIL.Image
+import PIL.ImageMath
 import urwid
 
+import assets
+import palette
 import slide
+import graphics as graphics_mod
+import stats
+import tools
 
 def nearest_color(x):
     if x < 0x30: return '0'
@@ -31,24 +42,219 @@ def nearest_color(x):
     if x < 0xe8: return 'd'
     return 'f'
 
+# Two hex digits (in either case) to the nearest color digit.
+NEAREST_HEX = {}
+for i in range(256):
+    NEAREST_HEX['%02x' % i] = NEAREST_HEX['%02X' % i] = nearest_color(i)
+del i
+
+MODES = ('ascii', 'full', 'half', 'quadrant')
+TRUECOLOR = 2**24
+
+# Standard xterm values for the 16 basic colors.
+BASIC_COLORS = [
+    ('black', (0, 0, 0)),
+    ('dark red', (205, 0, 0)),
+    ('dark green', (0, 205, 0)),
+    ('brown', (205, 205, 0)),
+    ('dark blue', (0, 0, 238)),
+    ('dark magenta', (205, 0, 205)),
+    ('dark cyan', (0, 205, 205)),
+    ('light gray', (229, 229, 229)),
+    ('dark gray', (127, 127, 127)),
+    ('light red', (255, 0, 0)),
+    ('light green', (0, 255, 0)),
+    ('yellow', (255, 255, 0)),
+    ('light blue', (92, 92, 255)),
+    ('light magenta', (255, 0, 255)),
+    ('light cyan', (0, 255, 255)),
+    ('white', (255, 255, 255)),
+]
+
+CUBE_LEVELS = [0, 95, 135, 175, 215, 255]
+
+# Indexed by the bit mask of the quadrants drawn in the foreground
+# color: top left 1, top right 2, bottom left 4, bottom right 8.
+QUADRANTS = [u' ', u'\u2598', u'\u259d', u'\u2580',
+             u'\u2596', u'\u258c', u'\u259e', u'\u259b',
+             u'\u2597', u'\u259a', u'\u2590', u'\u259c',
+             u'\u2584', u'\u2599', u'\u259f', u'\u2588']
+
+def _distance(a, b):
+    return ((a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2)
+
+def _nearest_256(rgb):
+    cube = [min(range(6), key=lambda i: abs(CUBE_LEVELS[i] - c))
+            for c in rgb]
+    cube_rgb = [CUBE_LEVELS[i] for i in cube]
+    gray = min(range(24), key=lambda i: abs(8 + i * 10 - sum(rgb) // 3))
+    gray_rgb = [8 + gray * 10] * 3
+    if _distance(rgb, gray_rgb) < _distance(rgb, cube_rgb):
+        return 'h%i' % (232 + gray)
+    return 'h%i' % (16 + cube[0] * 36 + cube[1] * 6 + cube[2])
+
+def _nearest_16(rgb):
+    return min(BASIC_COLORS, key=lambda c: _distance(rgb, c[1]))[0]
+
+class _HexColors(dict):
+    # 24-bit key to urwid truecolor name, filled in on demand.
+    def __missing__(self, key):
+        value = self[key] = '#%06x' % key
+        return value
+
+class ColorTable(object):
+    """Map 24-bit pixels to terminal colors a whole image at a time.
+
+    For 16 and 256 colors, pixels are reduced to 12 bits and looked up
+    in a table of the nearest terminal color computed once per color
+    depth; for truecolor the 24-bit value is used directly.  Pixel
+    keys are computed with PIL over the whole image rather than per
+    pixel in Python.
+    """
+
+    _tables = {}
+
+    def __init__(self, colors=256):
+        self.colors = colors
+        if colors == TRUECOLOR:
+            self.shift = 8
+            self.names = _HexColors()
+        else:
+            self.shift = 4
+            self.names = self._getTable(colors)
+
+    @classmethod
+    def _getTable(cls, colors):
+        table = cls._tables.get(colors)
+        if table is None:
+            if colors == 16:
+                nearest = _nearest_16
+            else:
+                nearest = _nearest_256
+            table = []
+            for key in range(4096):
+                rgb = ((key >> 8) * 17, ((key >> 4) & 15) * 17,
+                       (key & 15) * 17)
+                table.append(nearest(rgb))
+            cls._tables[colors] = table
+        return table
+
+    def getKeys(self, image):
+        """Return a list of rows of color keys for an RGB image."""
+        width, height = image.size
+        r, g, b = image.split()
+        if self.shift == 4:
+            reduce_table = [v >> 4 for v in range(256)]
+            r, g, b = [band.point(reduce_table) for band in (r, g, b)]
+        keys = PIL.ImageMath.eval('convert(r, "I") * %i + '
+                                  'convert(g, "I") * %i + '
+                                  'convert(b, "I")' % (
+                                      1 << (2 * self.shift), 1 << self.shift),
+                                  r=r, g=g, b=b)
+        data = list(keys.getdata())
+        return [data[y * width:(y + 1) * width] for y in range(height)]
+
+    def getRGB(self, key):
+        shift = self.shift
+        mask = (1 << shift) - 1
+        scale = 255 // mask
+        return ((key >> (2 * shift)) * scale, ((key >> shift) & mask) * scale,
+                (key & mask) * scale)
+
+class ImagePyramid(object):
+    """Successively halved copies of an image.
+
+    Nothing is decoded until an image is first needed; get() then
+    returns the smallest level at least as large as the requested
+    size, halving the image down to it as needed, so that small
+    renders only resample a small image.  The largest level is
+    limited to MAX_SIZE pixels on a side; the original is reloaded on
+    the rare occasion something larger is needed.
+    """
+
+    MAX_SIZE = 2048
+    MIN_SIZE = 16
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.levels = None
+        self.reduced = False
+
+    def _load(self):
+        image = self.loader().convert('RGB')
+        if max(image.size) > self.MAX_SIZE:
+            factor = float(self.MAX_SIZE) / max(image.size)
+            image = image.resize((max(1, int(image.size[0] * factor)),
+                                  max(1, int(image.size[1] * factor))),
+                                 PIL.Image.ANTIALIAS)
+            self.reduced = True
+        self.levels = [image]
+
+    def get(self, width, height):
+        """Return the nearest level at least width x height in size."""
+        with self.lock:
+            if self.levels is None:
+                self._load()
+            image = self.levels[-1]
+            while (image.size[0] // 2 >= width and
+                   image.size[1] // 2 >= height and
+                   min(image.size) // 2 >= self.MIN_SIZE):
+                image = image.resize((image.size[0] // 2,
+                                      image.size[1] // 2),
+                                     PIL.Image.ANTIALIAS)
+                self.levels.append(image)
+            for image in reversed(self.levels):
+                if image.size[0] >= width and image.size[1] >= height:
+                    return image
+            if not self.reduced:
+                return self.levels[0]
+        return self.loader().convert('RGB')
+
+    def resize(self, width, height):
+        return self.get(width, height).resize((width, height),
+                                              PIL.Image.ANTIALIAS)
+
 class ANSIImage(urwid.Widget):
-    def __init__(self, uri, hinter=None, scale=1, background=None):
+    def __init__(self, uri, hinter=None, scale=1, background=None,
+                 mode='ascii', colors=256, graphics=None):
         super(ANSIImage, self).__init__()
         self.uri = uri
-        image = self._loadImage()
+        self.key = uri
+        self.graphics = graphics
+        if mode != 'ascii' and mode != 'full':
+            if urwid.get_encoding_mode() != 'utf8':
+                # Block characters need a UTF-8 terminal.
+                mode = 'full'
+        self.mode = mode
+        self.colors = colors
+        # Only the header is read now; the pyramid decodes the image
+        # when it is first drawn.
+        width, height = self._readSize()
+        self.pyramid = ImagePyramid(self._loadImage)
         self.htmlparser = HTMLParser.HTMLParser()
-        self.ratio = float(image.size[0])/float(image.size[1])
+        self.ratio = float(width)/float(height)
         self.hinter = hinter
         if scale > 1:
             scale = 1
         self.scale = scale
         self.background = background or 'black'
-        self._prime = True
-        self.render((3,1))
-        self._prime = False
+        # Background jp2a calls by (width, height).
+        self._calls = {}
+        if mode == 'ascii' and not graphics:
+            # Note a missing jp2a now, while the presentation is loading.
+            if tools.runner.check('jp2a', uri) and hinter:
+                # Start converting the image for the screen as soon as
+                # its size is known.
+                hinter.subscribeWidget(self)
+                if hinter.screen is not None:
+                    self.screenResized()
+
+    def _readSize(self):
+        return PIL.Image.open(assets.open_seekable(self.uri)).size
 
     def _loadImage(self):
-        image = PIL.Image.open(self.uri)
+        image = PIL.Image.open(assets.open_seekable(self.uri))
         image.load()
         try:
             exif = image._getexif()
@@ -67,6 +273,44 @@ class ANSIImage(urwid.Widget):
                 image = image.rotate(90)
         return image
 
+    def screenResized(self):
+        # The size at which the image is shown on a slide of its own:
+        # the slide's padding gives it the width it packs to, which
+        # is then scaled as in render.
+        cols = self.pack((self.hinter.getSize()[0],))[0]
+        width, height = self.pack((cols * self.scale,))
+        self._calls = {}
+        self._submitASCII(int(width), int(height))
+
+    def _submitASCII(self, width, height, image=None):
+        # Run jp2a in the background; the image is resampled and
+        # encoded in the tool's thread as well.
+        key = (width, height)
+        call = self._calls.get(key)
+        if call is not None and image is None:
+            return call
+        def jpeg():
+            # jp2a averages the pixels under each character, so a few
+            # pixels per cell is plenty.
+            source = image
+            if source is None:
+                source = self.pyramid.get(width * 2, height * 4)
+            out = StringIO.StringIO()
+            source.save(out, 'JPEG')
+            return out.getvalue()
+        call = tools.runner.submit(['jp2a', '--colors', '--fill',
+                                    '--width=%s' % width,
+                                    '--height=%s' % height,
+                                    '--html-raw', '-'],
+                                   jpeg, description=self.uri)
+        if image is None:
+            self._calls[key] = call
+        return call
+
+    def getImage(self, width, height):
+        """Return the image resampled to width x height pixels."""
+        return self.pyramid.resize(width, height)
+
     def pack(self, size, focus=False):
         cols = size[0]
         if len(size) > 1:
@@ -94,9 +338,10 @@ class ANSIImage(urwid.Widget):
 
     SPAN_RE = re.compile(r"<span style='color:#(......); background-color:#(......);'>(.*)")
     def render(self, size, focus=False):
-        spanre = self.SPAN_RE
-        htmlparser = self.htmlparser
+        with stats.timer('ANSIImage.render'):
+            return self._render(size, focus)
 
+    def _render(self, size, focus=False):
         # Calculate image size and any bounding box
         total_width, total_height = self.pack(size, focus)
         width, height = self.pack([s * self.scale for s in size], focus)
@@ -106,35 +351,138 @@ class ANSIImage(urwid.Widget):
         bottom_pad = total_height - height - top_pad
         left_pad = (total_width - width) // 2
         right_pad = total_width - width - left_pad
-        padding_attr = urwid.AttrSpec(self.background, self.background)
+        padding_attr = palette.attr(self.background, self.background)
 
-        try:
-            jp2a = subprocess.Popen(['jp2a', '--colors', '--fill',
-                                     '--width=%s' % width,
-                                     '--height=%s' % height,
-                                     '--html-raw', '-'],
-                                    stdin=subprocess.PIPE,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE)
-        except OSError, e:
-            if self._prime:
-                if e.errno == 2:
-                    print("ERROR: jp2a is used but is not installed.")
-                else:
-                    print("ERROR: unable to run jp2a: %s" % e)
-                raw_input("Press ENTER to continue.")
-            data = self._blank(width, height)
+        if self.graphics and self.mode == 'ascii':
+            # The image is drawn over these cells once the screen is
+            # drawn; this is what shows if it can not be (for
+            # instance, during a dissolve).
+            lines = [(' ' * width, [(padding_attr, width)])] * height
         else:
-            image = self._loadImage()
-            image = image.convert('RGBA')
-            image.save(jp2a.stdin, 'JPEG')
-            jp2a.stdin.close()
-            data = jp2a.stdout.read()
-            jp2a.stderr.read()
-            jp2a.wait()
+            lines = self._renderLines(width, height)
 
         line_list = []
         attr_list = []
+
+        # Top pad
+        for padding in range(0, top_pad):
+            line_list.append(' ' * total_width)
+            attr_list.append([(padding_attr, 1)] * total_width)
+
+        for line_text, line_attrs in lines:
+            line_list.append(' ' * left_pad + line_text + ' ' * right_pad)
+            attr_list.append([(padding_attr, 1)] * left_pad + line_attrs +
+                             [(padding_attr, 1)] * right_pad)
+
+        # Bottom pad
+        for padding in range(0, bottom_pad):
+            line_list.append(' ' * total_width)
+            attr_list.append([(padding_attr, 1)] * total_width)
+
+        if self.mode == 'ascii':
+            canvas = urwid.TextCanvas(line_list, attr_list)
+        else:
+            # Block characters are all one column wide.
+            canvas = urwid.TextCanvas(line_list, attr_list,
+                                      maxcol=int(total_width),
+                                      check_width=False)
+        if self.graphics and width > 0 and height > 0:
+            graphics_mod.register(canvas, self, left_pad, top_pad,
+                                  width, height)
+        return canvas
+
+    def _renderLines(self, width, height, image=None):
+        # Returns (text, attributes) for each line of the image.  If
+        # no image is supplied, the pyramid is used.
+        if self.mode == 'ascii':
+            return self._renderASCII(width, height, image)
+        return self._renderBlocks(width, height, image)
+
+    def _renderBlocks(self, width, height, image=None):
+        # Each cell shows one (full), two (half) or four (quadrant)
+        # pixels of the resampled image.
+        if width < 1 or height < 1:
+            return []
+        if self.mode == 'full':
+            xscale, yscale = 1, 1
+        elif self.mode == 'half':
+            xscale, yscale = 1, 2
+        else:
+            xscale, yscale = 2, 2
+        if image is None:
+            image = self.pyramid.resize(width * xscale, height * yscale)
+        else:
+            image = image.resize((width * xscale, height * yscale),
+                                 PIL.Image.ANTIALIAS)
+        table = ColorTable(self.colors)
+        keys = table.getKeys(image)
+        names = table.names
+        colors = self.colors
+        lines = []
+        for y in range(height):
+            if self.mode == 'full':
+                row = keys[y]
+                cells = [(u' ', k, k) for k in row]
+            elif self.mode == 'half':
+                cells = [(u'\u2580', top, bottom) for top, bottom in
+                         zip(keys[y * 2], keys[y * 2 + 1])]
+            else:
+                top = keys[y * 2]
+                bottom = keys[y * 2 + 1]
+                cells = [self._quadrant(table, top[x], top[x + 1],
+                                        bottom[x], bottom[x + 1])
+                         for x in range(0, width * 2, 2)]
+            text = []
+            attrs = []
+            last = None
+            for char, fg, bg in cells:
+                char = char.encode('utf8')
+                text.append(char)
+                if (fg, bg) == last:
+                    attrs[-1][1] += len(char)
+                else:
+                    attrs.append([palette.attr(names[fg], names[bg], colors),
+                                  len(char)])
+                    last = (fg, bg)
+            lines.append((''.join(text), [tuple(a) for a in attrs]))
+        return lines
+
+    def _quadrant(self, table, *pixels):
+        # Split the four pixels into the two colors furthest apart
+        # and draw each pixel in whichever is closer.
+        distinct = list(set(pixels))
+        if len(distinct) == 1:
+            return (u' ', pixels[0], pixels[0])
+        if len(distinct) == 2:
+            fg, bg = distinct
+        else:
+            rgb = dict([(k, table.getRGB(k)) for k in distinct])
+            fg, bg = max([(a, b) for a in distinct for b in distinct
+                          if a < b],
+                         key=lambda p: _distance(rgb[p[0]], rgb[p[1]]))
+        mask = 0
+        for bit, key in zip((1, 2, 4, 8), pixels):
+            if key == fg:
+                mask |= bit
+            elif key != bg:
+                krgb = table.getRGB(key)
+                if (_distance(krgb, table.getRGB(fg)) <
+                    _distance(krgb, table.getRGB(bg))):
+                    mask |= bit
+        return (QUADRANTS[mask], fg, bg)
+
+    def _renderASCII(self, width, height, image=None):
+        spanre = self.SPAN_RE
+        htmlparser = self.htmlparser
+        data = None
+        if tools.runner.isAvailable('jp2a'):
+            # Usually already done, having been started when the
+            # screen size became known.
+            data = self._submitASCII(width, height, image).result()
+        if data is None:
+            data = self._blank(width, height)
+
+        lines = []
         line_text = ''
         line_attrs = []
         current_attr = [None, 0]
@@ -142,20 +490,10 @@ class ANSIImage(urwid.Widget):
         current_bg = None
         current_props = None
 
-        # Top pad
-        for padding in range(0, top_pad):
-            line_list.append(' ' * total_width)
-            attr_list.append([(padding_attr, 1)] * total_width)
-
         for line in data.split('<br/>'):
             if not line:
                 continue
 
-            # Left pad
-            line_text += ' ' * left_pad
-            for fake_attr in range(0, left_pad):
-                line_attrs.append((padding_attr, 1))
-
             for span in line.split('</span>'):
 
                 if not span:
@@ -169,20 +507,20 @@ class ANSIImage(urwid.Widget):
                 props = []
                 # TODO: if bold is set, append bold to props
                 fg = ('#'+
-                      nearest_color(int(fg[0:2], 16)) +
-                      nearest_color(int(fg[2:4], 16)) +
-                      nearest_color(int(fg[4:6], 16)))
+                      NEAREST_HEX[fg[0:2]] +
+                      NEAREST_HEX[fg[2:4]] +
+                      NEAREST_HEX[fg[4:6]])
                 bg = ('#'+
-                      nearest_color(int(bg[0:2], 16)) +
-                      nearest_color(int(bg[2:4], 16)) +
-                      nearest_color(int(bg[4:6], 16)))
+                      NEAREST_HEX[bg[0:2]] +
+                      NEAREST_HEX[bg[2:4]] +
+                      NEAREST_HEX[bg[4:6]])
                 if current_fg == fg and current_bg == bg and current_props == props:
                     current_attr[1] += len(char)
                 else:
                     if current_attr[0]:
                         line_attrs.append(tuple(current_attr))
                     fg = ', '.join(props + [fg])
-                    attr = urwid.AttrSpec(fg, bg)
+                    attr = palette.attr(fg, bg)
                     current_attr = [attr, len(char)]
                     current_fg = fg
                     current_bg = bg
@@ -192,23 +530,249 @@ class ANSIImage(urwid.Widget):
             current_fg = None
             current_bg = None
 
-            # Right pad
-            line_text += ' ' * right_pad
-            for fake_attr in range(0, right_pad):
-                line_attrs.append((padding_attr, 1))
-
-            line_list.append(line_text)
+            lines.append((line_text, line_attrs))
             line_text = ''
-            attr_list.append(line_attrs)
             line_attrs = []
+        return lines
 
-        # Bottom pad
-        for padding in range(0, bottom_pad):
-            line_list.append(' ' * total_width)
-            attr_list.append([(padding_attr, 1)] * total_width)
+class FrameSource(object):
+    """The frames of an animated image, or of a directory or zip
+    archive of images.
 
-        canvas = urwid.TextCanvas(line_list, attr_list)
-        return canvas
+    Frames are read one at a time as they are asked for, so nothing
+    but the frame being decoded is held in memory.  If interval is
+    given, it overrides the durations stored in the image.
+    """
+
+    DEFAULT_DURATION = 0.1
+
+    def __init__(self, uri, interval=None):
+        self.uri = uri
+        self.interval = interval
+        if os.path.isdir(uri):
+            self.files = sorted([os.path.join(uri, fn)
+                                 for fn in os.listdir(uri)
+                                 if not fn.startswith('.')],
+                                key=assets.natural_key)
+        elif assets.is_archive(uri):
+            self.files = assets.list_archive(uri)
+        else:
+            self.files = None
+
+    def _duration(self, image):
+        if self.interval is not None:
+            return self.interval
+        duration = image.info.get('duration')
+        if not duration:
+            # Like browsers, treat a GIF delay of zero as the default.
+            return self.DEFAULT_DURATION
+        return duration / 1000.0
+
+    def frames(self):
+        """Yield (image, duration) for each frame in turn."""
+        if self.files is not None:
+            for fn in self.files:
+                try:
+                    image = PIL.Image.open(assets.open_seekable(fn))
+                    frame = image.convert('RGB')
+                except IOError:
+                    # Not an image
+                    continue
+                yield frame, self._duration(image)
+            return
+        image = PIL.Image.open(assets.open_seekable(self.uri))
+        index = 0
+        while True:
+            try:
+                image.seek(index)
+            except EOFError:
+                break
+            yield image.convert('RGB'), self._duration(image)
+            index += 1
+
+    def size(self):
+        """Return the size of the first frame, reading only its header."""
+        for fn in self.files or [self.uri]:
+            try:
+                return PIL.Image.open(assets.open_seekable(fn)).size
+            except IOError:
+                if self.files is None:
+                    raise
+        raise IOError("No images found in %s" % self.uri)
+
+    def first(self):
+        for image, duration in self.frames():
+            return image
+        raise IOError("No images found in %s" % self.uri)
+
+# Placed in the queue after the last frame of a oneshot animation.
+END = object()
+
+class FrameDecoder(object):
+    """Decode and convert the frames of an animation in a thread.
+
+    At most lookahead frames wait in the queue, each already converted
+    to lines of text for the size the widget was last rendered at; the
+    thread blocks until playback takes one, so memory use does not
+    depend on the length of the animation.
+    """
+
+    def __init__(self, widget, lookahead):
+        self.widget = widget
+        self.queue = Queue.Queue(lookahead)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run,
+                                       name="Frame decoder")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+        return False
+
+    def _run(self):
+        widget = self.widget
+        try:
+            while True:
+                count = 0
+                for image, duration in widget.source.frames():
+                    count += 1
+                    target = widget.getTarget()
+                    lines = None
+                    if target is not None:
+                        with stats.timer('AnimatedImage.convert'):
+                            lines = widget._convert(target[0], target[1],
+                                                    image)
+                    if not self._put((image, duration, target, lines)):
+                        return
+                if widget.oneshot or not count:
+                    break
+        except IOError:
+            # The file has changed or is damaged; stop where it broke.
+            pass
+        self._put(END)
+
+    def stop(self):
+        self.stopped.set()
+
+class AnimatedImage(ANSIImage):
+    """An animated GIF, or a directory of numbered images, played as
+    an animation.
+
+    Frames are decoded ahead of playback by a FrameDecoder.  Playback
+    follows the clock: if the screen can not be drawn as fast as the
+    frames are due, frames are dropped rather than the animation
+    falling behind.
+    """
+
+    POLL_INTERVAL = 0.02
+
+    def __init__(self, uri, hinter=None, scale=1, background=None,
+                 mode='half', colors=256, interval=None, oneshot=False,
+                 lookahead=8):
+        self.source = FrameSource(uri, interval)
+        self.oneshot = oneshot
+        self.lookahead = lookahead
+        # The size last rendered at, which the decoder thread reads.
+        self.target = None
+        self.target_lock = threading.Lock()
+        self.frame = None
+        self.decoder = None
+        self.running = False
+        self.generation = 0
+        self.due = None
+        super(AnimatedImage, self).__init__(uri, hinter, scale, background,
+                                            mode, colors)
+
+    def _readSize(self):
+        return self.source.size()
+
+    def _loadImage(self):
+        # Shown until the animation starts.
+        return self.source.first()
+
+    def _convert(self, width, height, image):
+        return super(AnimatedImage, self)._renderLines(width, height, image)
+
+    def getTarget(self):
+        with self.target_lock:
+            return self.target
+
+    def _renderLines(self, width, height, image=None):
+        with self.target_lock:
+            self.target = (width, height)
+        if image is None and self.frame is not None:
+            image, duration, target, lines = self.frame
+            if target == (width, height):
+                return lines
+        return self._convert(width, height, image)
+
+    def startAnimation(self, loop):
+        if self.running:
+            return
+        self.running = True
+        if self.decoder is None:
+            self.decoder = FrameDecoder(self, self.lookahead)
+        self.due = time.time()
+        # Any alarm left from an earlier run is ignored.
+        self.generation += 1
+        loop.set_alarm_in(0, self.updateCallback, self.generation)
+
+    def updateCallback(self, loop=None, generation=None):
+        if not self.running or generation != self.generation:
+            return
+        with stats.timer('AnimatedImage.tick'):
+            delay = self._tick()
+        if self.running:
+            loop.set_alarm_in(delay, self.updateCallback, generation)
+
+    def _tick(self):
+        # Show the latest frame which is due, dropping any before it,
+        # and return how long to wait for the next one.
+        now = time.time()
+        frame = None
+        while self.due <= now:
+            try:
+                item = self.decoder.queue.get_nowait()
+            except Queue.Empty:
+                if frame is not None:
+                    # Decoding has fallen behind; give this frame its
+                    # full time rather than rushing the ones to come.
+                    self.due = now + frame[1]
+                break
+            if item is END:
+                self.running = False
+                break
+            if frame is not None:
+                stats.recorder.record('AnimatedImage.dropped', 0.0)
+            frame = item
+            self.due += frame[1]
+        if frame is not None:
+            self.frame = frame
+            self._invalidate()
+        if self.due <= now:
+            return self.POLL_INTERVAL
+        return self.due - now
+
+    def stopAnimation(self):
+        # Stop decoding too, rather than leave the decoder holding a
+        # queue of frames for a slide which is not shown.  The frame
+        # on screen is kept; playing again starts from the beginning.
+        self.running = False
+        if self.decoder is not None:
+            self.decoder.stop()
+            self.decoder = None
+
+    def resetAnimation(self):
+        self.stopAnimation()
+        if self.frame is not None:
+            self.frame = None
+            self._invalidate()
 
 def main():
     import PIL.Image
@@ -0,0 +1,193 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import cStringIO as StringIO
+
+import docutils.frontend
+import docutils.nodes
+import docutils.parsers.rst
+import docutils.utils
+
+import assets
+import cowsay
+import figlet
+import rst
+
+LEVELS = docutils.utils.Reporter.levels
+
+class LintVisitor(docutils.nodes.SparseNodeVisitor):
+    """Check the assets a presentation refers to without loading them.
+
+    Images, animations and ANSI art must exist, and figlet fonts and
+    cowfiles must be found by the built-in renderers unless the
+    external program is requested.  Problems are reported as warnings
+    through the document's reporter, like those from the parser.
+    Whether external programs are installed depends on the machine
+    giving the presentation, so that is not checked.
+    """
+
+    def __init__(self, document, basedir):
+        docutils.nodes.SparseNodeVisitor.__init__(self, document)
+        self.basedir = basedir
+
+    def unknown_visit(self, node):
+        pass
+
+    def unknown_departure(self, node):
+        pass
+
+    def warn(self, node, message):
+        self.document.reporter.warning(message, base_node=node)
+
+    def _checkFile(self, node, kind, name):
+        try:
+            found = assets.exists(os.path.join(self.basedir, name))
+        except assets.AssetError, e:
+            self.warn(node, str(e))
+            return
+        if not found:
+            self.warn(node, '%s file not found: %s' % (kind, name))
+
+    def visit_image(self, node):
+        self._checkFile(node, 'Image', node['uri'])
+
+    def visit_animation(self, node):
+        self._checkFile(node, 'Animation', node['uri'])
+
+    def visit_ansi(self, node):
+        for name in node['names']:
+            path = os.path.join(self.basedir, name)
+            if not assets.is_archive(path):
+                self._checkFile(node, 'ANSI', name)
+                continue
+            try:
+                if not assets.list_archive(path):
+                    self.warn(node, 'ANSI archive is empty: %s' % name)
+            except assets.AssetError, e:
+                self.warn(node, str(e))
+
+    def visit_figlet(self, node):
+        font = node.get('font') or figlet.DEFAULT_FONT
+        if not node.get('external') and figlet.find_font(font) is None:
+            self.warn(node, 'Unable to find figlet font %s' % font)
+
+    def visit_cowsay(self, node):
+        cow = node.get('cow') or cowsay.DEFAULT_COW
+        if not node.get('external') and cowsay.find_cow(cow) is None:
+            self.warn(node, 'Unable to find cowfile %s' % cow)
+
+def _problem(filename, source, line, level, message):
+    return dict(file=source or filename, line=line, level=LEVELS[level],
+                message=message)
+
+def lint_file(filename):
+    """Check a presentation file.
+
+    The file is parsed, and the nodes made by presentty's directives
+    checked with LintVisitor, but no slides are built.  Returns a
+    list of problems, each a dict with the file, line, level and
+    message.
+    """
+    rst.register_directives()
+    problems = []
+    try:
+        with open(filename) as f:
+            input = unicode(f.read(), 'utf-8')
+    except (IOError, UnicodeDecodeError), e:
+        return [_problem(filename, None, None,
+                         docutils.utils.Reporter.SEVERE_LEVEL, str(e))]
+    settings = docutils.frontend.OptionParser(
+        components=(docutils.parsers.rst.Parser,),
+        defaults=dict(warning_stream=StringIO.StringIO())
+    ).get_default_values()
+    document = docutils.utils.new_document(filename, settings)
+    reporter = document.reporter
+    def observe(msg):
+        if msg['level'] >= reporter.report_level:
+            message = msg.children and msg[0].astext() or u''
+            problems.append(_problem(filename, msg.get('source'),
+                                     msg.get('line'), msg['level'],
+                                     message))
+    reporter.attach_observer(observe)
+    try:
+        docutils.parsers.rst.Parser().parse(input, document)
+        document.walk(LintVisitor(document, os.path.dirname(filename)))
+    except docutils.utils.SystemMessage, e:
+        # A message at the halt level stops the parse.
+        problems.append(_problem(filename, None, None, e.level,
+                                 unicode(e.args[0])))
+    return problems
+
+def lint_files(filenames, jobs=None):
+    """Check each of the files (in separate processes if jobs is more
+    than one or None for one per CPU).  Returns a list of the
+    problems in all of them."""
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(filenames))
+    if jobs < 2:
+        results = [lint_file(fn) for fn in filenames]
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(lint_file, filenames, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    problems = []
+    for result in results:
+        problems.extend(result)
+    return problems
+
+def format_text(problems):
+    # The same form as the parser's own warnings.
+    lines = []
+    for problem in problems:
+        lines.append(u'%s:%s: (%s/%i) %s' % (
+            problem['file'], problem['line'] or '', problem['level'],
+            LEVELS.index(problem['level']), problem['message']))
+    return u'\n'.join(lines)
+
+def format_json(problems):
+    return json.dumps(problems, indent=2, sort_keys=True)
+
+def main():
+    argp = argparse.ArgumentParser(
+        description='Check presentation files for problems without '
+        'loading them')
+    argp.add_argument('files', nargs='+', metavar='file',
+                      help='presentation file (RST)')
+    argp.add_argument('--format', dest='format', default='text',
+                      choices=('text', 'json'),
+                      help='output format (default: text)')
+    argp.add_argument('--jobs', dest='jobs', default=0, type=int,
+                      help='check files in this many processes '
+                      '(default: one per CPU)')
+    args = argp.parse_args()
+    problems = lint_files(args.files, args.jobs or None)
+    if args.format == 'json':
+        print format_json(problems)
+    elif problems:
+        print format_text(problems).encode('utf8')
+    if problems:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
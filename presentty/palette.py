@@ -13,66 +13,202 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+
 import urwid
 
+class AttrTable(object):
+    """Intern urwid.AttrSpec objects.
+
+    Returns the same AttrSpec for every request of the same colors so
+    that attributes are not constantly reallocated and may be compared
+    by identity.  The returned specs are shared and must not be
+    modified.
+
+    Each attribute may also be compiled to a small integer id, which
+    indexes tables of precomputed RGB values and display properties so
+    that frame loops can blend colors without calling into urwid.
+    """
+
+    PROPS = ('bold', 'underline', 'standout', 'blink')
+    TRANSIENT_SIZE = 4096
+
+    def __init__(self):
+        self.specs = {}
+        self.canonical = {}
+        self.hits = 0
+        self.misses = 0
+        self.ids = {}
+        self.by_id = []
+        # Foreground and background RGB, with default colors resolved
+        # against the default background.
+        self.rgb = []
+        # The background RGB repeated in place of the foreground; used
+        # for cells that only contribute a background color.
+        self.bg_rgb = []
+        self.props = []
+        self.default = None
+        self.transient = collections.OrderedDict()
+
+    def get(self, fg, bg, colors=256):
+        key = (fg, bg, colors)
+        spec = self.specs.get(key)
+        if spec is not None:
+            self.hits += 1
+            return spec
+        self.misses += 1
+        spec = urwid.AttrSpec(fg, bg, colors)
+        # Different spellings of the same attribute ('bold, #0f0' and
+        # '#0f0, bold') share a spec as well.
+        canonical_key = (spec.foreground, spec.background, colors)
+        spec = self.canonical.setdefault(canonical_key, spec)
+        self.specs[key] = spec
+        return spec
+
+    def getId(self, spec):
+        """Return the integer id of an attribute, compiling it if needed."""
+        attr_id = self.ids.get(spec)
+        if attr_id is not None:
+            return attr_id
+        if spec is None:
+            attr_id = self.getId(self.getDefault())
+            self.ids[None] = attr_id
+            return attr_id
+        # Only interned specs are remembered (by identity); any other
+        # spec is looked up by its colors each time, so that the
+        # table does not hold on to it.
+        shared = self.get(spec.foreground, spec.background, spec.colors)
+        attr_id = self.ids.get(shared)
+        if attr_id is None:
+            attr_id = self._compile(shared)
+        return attr_id
+
+    def getTransient(self, fg, bg, colors=256):
+        """Return an AttrSpec for a color which is only shown briefly.
+
+        The colors blended for each frame of a transition are not
+        worth interning; only the most recently used are kept.
+        """
+        key = (fg, bg, colors)
+        spec = self.transient.pop(key, None)
+        if spec is None:
+            spec = self.specs.get(key)
+            if spec is not None:
+                return spec
+            spec = urwid.AttrSpec(fg, bg, colors)
+            if len(self.transient) >= self.TRANSIENT_SIZE:
+                self.transient.popitem(last=False)
+        self.transient[key] = spec
+        return spec
+
+    def getDefault(self):
+        if self.default is None:
+            self.default = self.get('light gray', 'black')
+        return self.default
+
+    def _compile(self, spec):
+        rgb = spec.get_rgb_values()
+        default_rgb = self.getDefault().get_rgb_values()
+        if None in rgb:
+            rgb = default_rgb
+        attr_id = len(self.by_id)
+        self.by_id.append(spec)
+        self.rgb.append(tuple(rgb))
+        self.bg_rgb.append(tuple(rgb[3:]*2))
+        self.props.append(tuple([p for p in self.PROPS
+                                 if getattr(spec, p)]))
+        self.ids[spec] = attr_id
+        return attr_id
+
+    def compile(self, palette):
+        """Assign ids to every attribute of a palette up front."""
+        for spec in palette.values():
+            self.getId(spec)
+
+    def getStats(self):
+        total = self.hits + self.misses
+        if total:
+            hit_rate = float(self.hits) / total
+        else:
+            hit_rate = 0.0
+        return dict(size=len(self.canonical), keys=len(self.specs),
+                    hits=self.hits, misses=self.misses, hit_rate=hit_rate)
+
+    def getReport(self):
+        stats = self.getStats()
+        return ('Attributes: %(size)i interned, %(hits)i hits, '
+                '%(misses)i misses (%(hit_rate).1f%% hit rate)' %
+                dict(stats, hit_rate=stats['hit_rate']*100))
+
+ATTR_TABLE = AttrTable()
+
+def attr(fg, bg, colors=256):
+    return ATTR_TABLE.get(fg, bg, colors)
+
+def transient_attr(fg, bg, colors=256):
+    return ATTR_TABLE.getTransient(fg, bg, colors)
+
+def attr_id(spec):
+    return ATTR_TABLE.getId(spec)
+
 DARK_PALETTE = {
-    '_default': urwid.AttrSpec('light gray', 'black'),
+    '_default': attr('light gray', 'black'),
 
-    'emphasis': urwid.AttrSpec('bold, light gray', 'black'),
-    'title': urwid.AttrSpec('bold, white', 'black'),
+    'emphasis': attr('bold, light gray', 'black'),
+    'title': attr('bold, white', 'black'),
 
-    'progressive': urwid.AttrSpec('dark gray', 'black'),
+    'progressive': attr('dark gray', 'black'),
 
     # Based on pygments default colors
 
-    'whitespace': urwid.AttrSpec('light gray', '#aaa'),
-    'comment': urwid.AttrSpec('#688', 'black'),
-    'comment-preproc': urwid.AttrSpec('#a80', 'black'),
-    'keyword': urwid.AttrSpec('bold, #0f0', 'black'),
-    'keyword-pseudo': urwid.AttrSpec('#080', 'black'),
-    'keyword-type': urwid.AttrSpec('#a06', 'black'),
-    'operator': urwid.AttrSpec('#666', 'black'),
-    'operator-word': urwid.AttrSpec('bold, #a0f', 'black'),
-    'name-builtin': urwid.AttrSpec('#0d0', 'black'),
-    'name-function': urwid.AttrSpec('#00f', 'black'),
-    'name-class': urwid.AttrSpec('bold, #00f', 'black'),
-    'name-namespace': urwid.AttrSpec('bold, #00f', 'black'),
-    'name-exception': urwid.AttrSpec('bold, #d66', 'black'),
-    'name-variable': urwid.AttrSpec('#008', 'black'),
-    'name-constant': urwid.AttrSpec('#800', 'black'),
-    'name-label': urwid.AttrSpec('#aa0', 'black'),
-    'name-entity': urwid.AttrSpec('bold, #888', 'black'),
-    'name-attribute': urwid.AttrSpec('#880', 'black'),
-    'name-tag': urwid.AttrSpec('bold, #080', 'black'),
-    'name-decorator': urwid.AttrSpec('#a0f', 'black'),
-    'string': urwid.AttrSpec('#a00', 'black'),
-    'string-doc': urwid.AttrSpec('light gray', 'black'),
-    'string-interpol': urwid.AttrSpec('bold, #a68', 'black'),
-    'string-escape': urwid.AttrSpec('bold, #a60', 'black'),
-    'string-regex': urwid.AttrSpec('#a68', 'black'),
-    'string-symbol': urwid.AttrSpec('#008', 'black'),
-    'string-other': urwid.AttrSpec('#080', 'black'),
-    'number': urwid.AttrSpec('#666', 'black'),
-    'generic-heading': urwid.AttrSpec('bold, #008', 'black'),
-    'generic-subheading': urwid.AttrSpec('bold, #808', 'black'),
-    'generic-deleted': urwid.AttrSpec('#a00', 'black'),
-    'generic-inserted': urwid.AttrSpec('#0a0', 'black'),
-    'generic-error': urwid.AttrSpec('#f00', 'black'),
-    'generic-emph': urwid.AttrSpec('bold, #fff', 'black'),
-    'generic-strong': urwid.AttrSpec('bold, #ddd', 'black'),
-    'generic-prompt': urwid.AttrSpec('bold, #008', 'black'),
-    'generic-output': urwid.AttrSpec('#888', 'black'),
-    'generic-traceback': urwid.AttrSpec('#06d', 'black'),
-    'error': urwid.AttrSpec('underline, #f00', 'black'),
+    'whitespace': attr('light gray', '#aaa'),
+    'comment': attr('#688', 'black'),
+    'comment-preproc': attr('#a80', 'black'),
+    'keyword': attr('bold, #0f0', 'black'),
+    'keyword-pseudo': attr('#080', 'black'),
+    'keyword-type': attr('#a06', 'black'),
+    'operator': attr('#666', 'black'),
+    'operator-word': attr('bold, #a0f', 'black'),
+    'name-builtin': attr('#0d0', 'black'),
+    'name-function': attr('#00f', 'black'),
+    'name-class': attr('bold, #00f', 'black'),
+    'name-namespace': attr('bold, #00f', 'black'),
+    'name-exception': attr('bold, #d66', 'black'),
+    'name-variable': attr('#008', 'black'),
+    'name-constant': attr('#800', 'black'),
+    'name-label': attr('#aa0', 'black'),
+    'name-entity': attr('bold, #888', 'black'),
+    'name-attribute': attr('#880', 'black'),
+    'name-tag': attr('bold, #080', 'black'),
+    'name-decorator': attr('#a0f', 'black'),
+    'string': attr('#a00', 'black'),
+    'string-doc': attr('light gray', 'black'),
+    'string-interpol': attr('bold, #a68', 'black'),
+    'string-escape': attr('bold, #a60', 'black'),
+    'string-regex': attr('#a68', 'black'),
+    'string-symbol': attr('#008', 'black'),
+    'string-other': attr('#080', 'black'),
+    'number': attr('#666', 'black'),
+    'generic-heading': attr('bold, #008', 'black'),
+    'generic-subheading': attr('bold, #808', 'black'),
+    'generic-deleted': attr('#a00', 'black'),
+    'generic-inserted': attr('#0a0', 'black'),
+    'generic-error': attr('#f00', 'black'),
+    'generic-emph': attr('bold, #fff', 'black'),
+    'generic-strong': attr('bold, #ddd', 'black'),
+    'generic-prompt': attr('bold, #008', 'black'),
+    'generic-output': attr('#888', 'black'),
+    'generic-traceback': attr('#06d', 'black'),
+    'error': attr('underline, #f00', 'black'),
 }
 
 LIGHT_PALETTE = {}
 for k, v in DARK_PALETTE.items():
-    LIGHT_PALETTE[k] = urwid.AttrSpec(v.foreground, 'h15')
+    LIGHT_PALETTE[k] = attr(v.foreground, 'h15')
 
 LIGHT_PALETTE.update({
-    '_default': urwid.AttrSpec('black', 'h15'),
-    'emphasis': urwid.AttrSpec('bold, black', 'h15'),
-    'title': urwid.AttrSpec('bold, #000', 'h15'),
-    'progressive': urwid.AttrSpec('light gray', 'h15'),
+    '_default': attr('black', 'h15'),
+    'emphasis': attr('bold, black', 'h15'),
+    'title': attr('bold, #000', 'h15'),
+    'progressive': attr('light gray', 'h15'),
 })
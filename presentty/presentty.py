@@ -15,29 +15,73 @@
 
 import argparse
 import os
+import resource
 import sys
 import time
 
 import urwid
 
+import graphics as graphics_mod
+import lint
 import slide
 import server
 import rst
 import palette
+import search
+import stats
+import tools
 
 
+class MainLoop(urwid.MainLoop):
+    graphics = None
+
+    def draw_screen(self):
+        if not stats.recorder.enabled and not self.graphics:
+            return super(MainLoop, self).draw_screen()
+        start = time.time()
+        if not self.screen_size:
+            self.screen_size = self.screen.get_cols_rows()
+        with stats.timer('layout'):
+            canvas = self._topmost_widget.render(self.screen_size, focus=True)
+        if self.graphics:
+            self.graphics.prepare(self.screen, canvas)
+        with stats.timer('terminal'):
+            self.screen.draw_screen(self.screen_size, canvas)
+        if self.graphics:
+            with stats.timer('graphics'):
+                self.graphics.emit(self.screen)
+        stats.recorder.frame(time.time() - start)
+
 class Presenter(object):
-    def __init__(self, palette):
+    stats_interval = 0.5
+
+    def __init__(self, palette, hinter=None, graphics=None):
         blank = urwid.Text(u'')
         self.blank = slide.UrwidSlide('Blank', None, blank,
                                       palette['_default'])
         self.current = self.blank
         self.program = []
+        self.builder = None
+        self.window = None
+        self.search_index = None
         self.palette = palette
         self.pos = -1
-        self.loop = urwid.MainLoop(self.blank,
-                                   unhandled_input=self.unhandledInput)
+        self.stats_text = urwid.Text(u'')
+        self.stats_box = urwid.AttrMap(urwid.LineBox(self.stats_text),
+                                       palette['_default'])
+        self.show_stats = False
+        self.layout_queue = []
+        self.layout_alarm = None
+        self.loop = MainLoop(self.blank,
+                             unhandled_input=self.unhandledInput,
+                             input_filter=self.inputFilter)
         self.loop.screen.set_terminal_properties(colors=256)
+        if graphics:
+            self.loop.graphics = graphics_mod.GraphicsManager(graphics)
+        self.hinter = hinter
+        if hinter:
+            hinter.setScreen(self.loop.screen)
+            hinter.subscribe(self.startLayout)
 
         self.server_pipe_in = self.loop.watch_pipe(self.serverData)
         r,w = os.pipe()
@@ -48,6 +92,10 @@ class Presenter(object):
 
     def serverData(self, data):
         parts = data.split()
+        with stats.timer('server.' + parts[0]):
+            self._serverCommand(parts)
+
+    def _serverCommand(self, parts):
         if parts[0] == 'jump':
             try:
                 index = int(parts[1])
@@ -66,22 +114,131 @@ class Presenter(object):
             self.prevSlide()
             os.write(self.server_pipe_out_write, 'ok\n')
 
-    def setProgram(self, program):
+    def setProgram(self, program, builder=None, window=None,
+                   search_index=None):
+        """Set the slides to present.
+
+        If a window size and builder (a PresentationParser) are given,
+        only the slides within that many positions of the current
+        slide are built; the program may hold SlideStubs, which are
+        built from their source when they come into range, and slides
+        which leave it are replaced by stubs again.
+        The search index made by the parser may be given; otherwise
+        one is made here, before the slides can be replaced by stubs
+        or built again.
+        """
         self.program = program
+        self.builder = builder
+        self.window = window
+        if search_index is None:
+            search_index = search.index_program(program)
+        self.search_index = search_index
+        self.updateWindow(max(self.pos, 0))
+
+    def updateWindow(self, pos):
+        if self.window is None:
+            return
+        for i, s in enumerate(self.program):
+            keep = abs(i - pos) <= self.window
+            if keep and isinstance(s, slide.SlideStub):
+                with stats.timer('build'):
+                    self.program[i] = self.builder.build(s.source)
+            elif (not keep and not isinstance(s, slide.SlideStub)
+                  and s is not self.current):
+                self.program[i] = slide.SlideStub(s.title, s.source)
+
+    def getSearchIndex(self):
+        return self.search_index
+
+    def getMemoryUsage(self):
+        """Return (built slides, total slides, resident set size in KiB)."""
+        built = len([s for s in self.program
+                     if not isinstance(s, slide.SlideStub)])
+        try:
+            with open('/proc/self/statm') as f:
+                pages = int(f.read().split()[1])
+            rss = pages * resource.getpagesize() // 1024
+        except (IOError, IndexError, ValueError):
+            # Fall back to the peak, which is all that is portable.
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return (built, len(self.program), rss)
 
     def run(self):
         self.loop.set_alarm_in(0, self.nextSlide)
+        self.startLayout()
         self.loop.run()
 
+    def inputFilter(self, keys, raw):
+        if 'window resize' in keys:
+            if self.hinter:
+                self.hinter.resized()
+            else:
+                self.startLayout()
+        return keys
+
+    def startLayout(self):
+        """Lay out all slides for the current screen size in the background.
+
+        One slide is laid out per main loop iteration so that input
+        is still handled promptly.  The current slide goes first,
+        followed by its neighbors, then the rest.
+        """
+        self.layout_queue = range(len(self.program))
+        self.prioritizeLayout(self.pos)
+        if self.layout_alarm is None:
+            self.layout_alarm = self.loop.set_alarm_in(0, self.layoutCallback)
+
+    def prioritizeLayout(self, pos):
+        pos = max(pos, 0)
+        # Prefer the following slide over the preceding one.
+        self.layout_queue.sort(key=lambda i: (abs(i - pos), i < pos))
+
+    def layoutCallback(self, loop=None, data=None):
+        self.layout_alarm = None
+        if not self.layout_queue:
+            return
+        s = self.program[self.layout_queue.pop(0)]
+        if not isinstance(s, slide.SlideStub):
+            with stats.timer('layout.slide'):
+                s.layout(self.loop.screen.get_cols_rows())
+        self.layout_alarm = self.loop.set_alarm_in(0, self.layoutCallback)
+
     def unhandledInput(self, key):
         if key in ('right', 'page down'):
             self.nextSlide()
         elif key in ('left', 'page up'):
             self.prevSlide()
+        elif key == 'f':
+            self.toggleStats()
         elif key == 'q':
             raise urwid.ExitMainLoop()
 
+    def setWidget(self, widget):
+        if self.show_stats:
+            widget = urwid.Overlay(self.stats_box, widget,
+                                   'right', 40, 'top', 'pack')
+        self.loop.widget = widget
+
+    def toggleStats(self):
+        self.show_stats = not self.show_stats
+        if self.show_stats:
+            stats.recorder.enable()
+            self.updateStats()
+        self.setWidget(self.current)
+
+    def updateStats(self, loop=None, data=None):
+        if not self.show_stats:
+            return
+        self.stats_text.set_text(stats.recorder.getOverlayText())
+        self.loop.set_alarm_in(self.stats_interval, self.updateStats)
+
     def transitionTo(self, index, forward=True):
+        with stats.timer('transitionTo'):
+            self._transitionTo(index, forward)
+
+    def _transitionTo(self, index, forward=True):
+        self.updateWindow(index)
+        self.prioritizeLayout(index)
         self.pos = index
         current_slide = self.current
         new_slide = self.program[index]
@@ -96,7 +253,7 @@ class Presenter(object):
             transition.setTargets(current_slide, new_slide)
         else:
             transition.setTargets(new_slide, current_slide)
-        self.loop.widget = transition
+        self.setWidget(transition)
         duration = transition.getDuration()
         start = time.time()
         now = start
@@ -107,13 +264,17 @@ class Presenter(object):
             else:
                 progress = max(((end-now)/duration), 0.0)
             transition.setProgress(progress)
+            if self.show_stats:
+                self.stats_text.set_text(stats.recorder.getOverlayText())
             self.loop.draw_screen()
             now = time.time()
             if now >= end:
                 break
         end = time.time()
-        self.loop.widget = new_slide
+        self.setWidget(new_slide)
         self.current = new_slide
+        # Now that the old slide is off screen, it may be evicted.
+        self.updateWindow(index)
         self.loop.draw_screen()
         current_slide.resetAnimation()
         new_slide.startAnimation(self.loop)
@@ -142,7 +303,24 @@ def main():
     parser.add_argument('--warnings', dest='warnings',
                         default=False,
                         action='store_true',
-                        help='print RST parser warnings and exit if any')
+                        help='check the presentation and exit if there are '
+                        'any warnings (see presentty-lint)')
+    parser.add_argument('--stats', dest='stats',
+                        default=False,
+                        action='store_true',
+                        help='record rendering timings from startup '
+                        '(press f to show them)')
+    parser.add_argument('--window', dest='window',
+                        default=None, type=int,
+                        help='to bound memory use, only keep this many '
+                        'slides on each side of the current one built')
+    parser.add_argument('--graphics', dest='graphics',
+                        default='none',
+                        choices=('none', 'auto') + graphics_mod.BACKENDS,
+                        help='draw images with an inline graphics protocol '
+                        '(auto detects kitty or sixel support)')
+    rst.add_jobs_argument(parser)
+    rst.add_profile_arguments(parser)
     parser.add_argument('file',
                         help='presentation file (RST)')
     args = parser.parse_args()
@@ -151,14 +329,35 @@ def main():
     else:
         plt = palette.DARK_PALETTE
     hinter = slide.ScreenHinter()
-    parser = rst.PresentationParser(plt, hinter)
-    program = parser.parse(unicode(open(args.file).read(), 'utf-8'), args.file)
+    if args.graphics == 'auto':
+        graphics = graphics_mod.detect()
+    elif args.graphics == 'none':
+        graphics = None
+    else:
+        graphics = args.graphics
     if args.warnings:
-        w = parser.warnings.getvalue()
-        if w:
-            print w
+        # Check the file before spending time building the slides.
+        problems = lint.lint_file(args.file)
+        if problems:
+            print lint.format_text(problems).encode('utf8')
             sys.exit(1)
-    p = Presenter(plt)
-    p.setProgram(program)
-    hinter.setScreen(p.loop.screen)
+    parser = rst.PresentationParser(plt, hinter, graphics, args.jobs)
+    document, visitor, profile = rst.profile_parse(
+        parser, unicode(open(args.file).read(), 'utf-8'), args.file, args,
+        stubs=args.window is not None)
+    program = visitor.program
+    if profile:
+        print rst.profile_report(profile, args).encode('utf8')
+        sys.exit(0)
+    failures = tools.runner.getSummary()
+    if failures:
+        print failures.encode('utf8')
+        raw_input("Press ENTER to continue.")
+    if args.stats:
+        stats.recorder.enable()
+    p = Presenter(plt, hinter, graphics)
+    if args.window is not None:
+        p.setProgram(program, parser, args.window, parser.search_index)
+    else:
+        p.setProgram(program, search_index=parser.search_index)
     p.run()
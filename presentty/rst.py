@@ -13,27 +13,31 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import copy
+import multiprocessing
 import os
 import re
+import time
 import docutils
 import docutils.frontend
 import docutils.parsers.rst
+import docutils.parsers.rst.states
 import docutils.nodes
+import docutils.statemachine
+import docutils.utils
 import cStringIO as StringIO
 
 import urwid
 
 import slide
 import transition as transition_mod
-import image
 import ansiparser
-import text
-
-try:
-    import PIL
-    import PIL.Image
-except ImportError:
-    PIL = None
+import assets
+import highlight
+import palette as palette_mod
+import search
+import stats
+import tools
 
 DEFAULT_TRANSITION = 'dissolve'
 DEFAULT_TRANSITION_DURATION = 0.4
@@ -61,14 +65,36 @@ class TextAccumulator(object):
             return u''
         return ret
 
+def _sections(node):
+    # The sections in node in the order the translator departs them.
+    for child in node.children:
+        if isinstance(child, docutils.nodes.Element):
+            for section in _sections(child):
+                yield section
+    if isinstance(node, docutils.nodes.section):
+        yield node
+
+class SlideSource(object):
+    """What is needed to build a slide again after it has been evicted."""
+    def __init__(self, node, basedir, default_transition, default_hide_title):
+        self.node = node
+        self.basedir = basedir
+        self.default_transition = default_transition
+        self.default_hide_title = default_hide_title
+
 class UrwidTranslator(docutils.nodes.GenericNodeVisitor):
     transition_map = {'dissolve': transition_mod.DissolveTransition,
                       'cut': transition_mod.CutTransition,
                       'pan': transition_mod.PanTransition,
                       'tilt': transition_mod.TiltTransition,
+                      'wipe': transition_mod.WipeTransition,
+                      'iris': transition_mod.IrisTransition,
+                      'fade': transition_mod.FadeTransition,
+                      'slideover': transition_mod.SlideOverTransition,
                       }
 
-    def __init__(self, document, palette, hinter=None, basedir='.'):
+    def __init__(self, document, palette, hinter=None, basedir='.',
+                 profile=None, graphics=None, stubs=False, jobs=None):
         docutils.nodes.GenericNodeVisitor.__init__(self, document)
         self.program = []
         self.stack = []
@@ -82,15 +108,27 @@ class UrwidTranslator(docutils.nodes.GenericNodeVisitor):
         self.progressives = []
         self.palette = palette
         self.hinter = hinter
+        self.graphics = graphics
         self.basedir = basedir
         self.slide = None
         self.default_hide_title = False
         self.hide_title = self.default_hide_title
+        self.profile = profile
+        self.slide_start = None
+        self.search_index = search.SearchIndex()
+        self.stubs = stubs
+        # Processes to parse ANSI frames in (see ansiparser.load_frames).
+        self.jobs = jobs
 
     def _make_transition(self, name, duration):
         tr = self.transition_map[name]
         return tr(duration)
 
+    def _assetTimer(self, kind, name):
+        if self.profile:
+            return self.profile.asset(kind, name)
+        return stats.NULL_TIMER
+
     def default_visit(self, node):
         """Override for generic, uniform traversals."""
         pass
@@ -142,7 +180,30 @@ class UrwidTranslator(docutils.nodes.GenericNodeVisitor):
         #print node.astext()
         raise docutils.nodes.SkipNode()
 
+    def _stubSection(self, node):
+        # Note where each slide in the section comes from, in the order
+        # they would be built, but build none of them.
+        for section in _sections(node):
+            # A section holding others ends up as the slide of the last
+            # one in it, as it does when it is built.
+            last = list(section.traverse(docutils.nodes.section))[-1]
+            title = u''
+            if last.children and isinstance(last[0], docutils.nodes.title):
+                title = last[0].astext()
+            source = SlideSource(section, self.basedir,
+                                 self.default_transition,
+                                 self.default_hide_title)
+            self.slide = slide.SlideStub(title, source)
+            self.program.append(self.slide)
+            self.search_index.add(len(self.program)-1, section)
+
     def visit_section(self, node):
+        if self.stubs:
+            self._stubSection(node)
+            raise docutils.nodes.SkipNode()
+        if self.profile:
+            self.slide_start = time.time()
+            self.profile.slideStarted()
         self.hide_title = self.default_hide_title
         self.transition = self.default_transition
         title_pile = slide.SlidePile([])
@@ -157,6 +218,8 @@ class UrwidTranslator(docutils.nodes.GenericNodeVisitor):
         ])
         s = slide.UrwidSlide(u'', self.transition, outer_pile,
                              self.palette['_default'])
+        s.source = SlideSource(node, self.basedir, self.default_transition,
+                               self.default_hide_title)
         self.slide = s
         self.stack.append(main_pile)
         self.title_pile = title_pile
@@ -171,8 +234,13 @@ class UrwidTranslator(docutils.nodes.GenericNodeVisitor):
         self.slide.transition = self.transition
         if self.hide_title:
             self.title_pile.contents[:] = []
+        self.slide.scopeLayout()
         self.program.append(self.slide)
+        self.search_index.add(len(self.program)-1, node)
         self.stack.pop()
+        if self.profile:
+            self.profile.slideFinished(len(self.program)-1, self.slide.title,
+                                       time.time() - self.slide_start)
 
     def visit_block_quote(self, node):
         self.stack.append(slide.SlidePile([]))
@@ -245,7 +313,24 @@ class UrwidTranslator(docutils.nodes.GenericNodeVisitor):
         text = self.stack.pop()
         self._append(node, urwid.Text(text.getFlowedText()), 'pack')
 
-    visit_literal_block = visit_textelement
+    def visit_literal_block(self, node):
+        text = TextAccumulator()
+        self.stack.append(text)
+        if 'highlight' not in node:
+            return
+        # A code block: highlight it directly rather than visiting a
+        # node per token.
+        language = node['highlight']
+        with self._assetTimer('code', language or 'text'):
+            try:
+                markup = highlight.cache.get(node.astext(), language,
+                                             self.palette,
+                                             node.get('startline'))
+            except highlight.LexerError:
+                # Already reported by the directive
+                markup = [node.astext()]
+        text.text.extend(markup)
+        raise docutils.nodes.SkipChildren()
 
     def depart_literal_block(self, node):
         text = self.stack.pop()
@@ -311,24 +396,57 @@ class UrwidTranslator(docutils.nodes.GenericNodeVisitor):
         self.attr.pop()
 
     def visit_image(self, node):
-        if not PIL:
+        # The image module (and PIL) is only loaded for decks with
+        # images.
+        try:
+            import image
+        except ImportError:
+            # PIL is optional
             return
         uri = node['uri']
         scale = float(node.get('scale', 100))/100.0
         fn = os.path.join(self.basedir, uri)
-        w = image.ANSIImage(fn, self.hinter, scale=scale,
-                background=self.palette['_default'].background)
+        with self._assetTimer('image', uri):
+            w = image.ANSIImage(fn, self.hinter, scale=scale,
+                    background=self.palette['_default'].background,
+                    mode=node.get('mode', 'ascii'),
+                    colors=node.get('colors', 256),
+                    graphics=self.graphics)
         self._append(node, w, 'pack')
 
+    def visit_animation(self, node):
+        try:
+            import image
+        except ImportError:
+            # PIL is optional
+            return
+        uri = node['uri']
+        scale = float(node.get('scale', 100))/100.0
+        fn = os.path.join(self.basedir, uri)
+        with self._assetTimer('animation', uri):
+            animation = image.AnimatedImage(fn, self.hinter, scale=scale,
+                    background=self.palette['_default'].background,
+                    mode=node.get('mode', 'half'),
+                    colors=node.get('colors', 256),
+                    interval=node.get('interval'),
+                    oneshot=node.get('oneshot', False),
+                    lookahead=node.get('lookahead', 8))
+        self.slide.animations.append(animation)
+        self._append(node, animation, 'pack')
+
+    def depart_animation(self, node):
+        pass
+
     def visit_ansi(self, node):
         interval = node.get('interval', 0.5)
         oneshot = node.get('oneshot', False)
         animation = slide.AnimatedText(interval, oneshot)
-        for name in node['names']:
-            p = ansiparser.ANSIParser()
-            fn = os.path.join(self.basedir, name)
-            data = unicode(open(fn).read(), 'utf8')
-            text = p.parse(data)
+        names = node['names']
+        with self._assetTimer('ansi', ' '.join(names)):
+            frames = ansiparser.load_frames(assets.expand(
+                [os.path.join(self.basedir, name) for name in names]),
+                self.jobs)
+        for text in frames:
             animation.addFrame(text)
         self.slide.animations.append(animation)
         self._append(node, animation, 'pack')
@@ -337,14 +455,21 @@ class UrwidTranslator(docutils.nodes.GenericNodeVisitor):
         pass
 
     def visit_figlet(self, node):
-        figlet = text.FigletText(node['text'])
+        import text
+        with self._assetTimer('figlet', node['text']):
+            figlet = text.FigletText(node['text'], font=node.get('font'),
+                                     external=node.get('external'))
         self._append(node, figlet, 'pack')
 
     def depart_figlet(self, node):
         pass
 
     def visit_cowsay(self, node):
-        cowsay = text.CowsayText(node['text'])
+        import text
+        with self._assetTimer('cowsay', node['text']):
+            cowsay = text.CowsayText(node['text'], cow=node.get('cow'),
+                                     width=node.get('width'),
+                                     external=node.get('external'))
         self._append(node, cowsay, 'pack')
 
     def depart_cowsay(self, node):
@@ -362,13 +487,65 @@ class UrwidTranslator(docutils.nodes.GenericNodeVisitor):
         if 'progressive' in node.get('classes'):
             self.progressives.pop()
 
+def image_colors(argument):
+    value = docutils.parsers.rst.directives.choice(
+        argument, ('16', '256', 'truecolor'))
+    if value == 'truecolor':
+        return 2**24
+    return int(value)
+
+def image_mode(argument):
+    return docutils.parsers.rst.directives.choice(
+        argument, ('ascii', 'full', 'half', 'quadrant'))
+
+_image_directive = None
+
+def get_image_directive():
+    """Return the image directive with presentty's rendering options.
+
+    The standard directive's module loads PIL, so the subclass is only
+    defined when a parser is created.  Options end up as attributes of
+    the image node.
+    """
+    global _image_directive
+    if _image_directive is None:
+        import docutils.parsers.rst.directives.images
+        Image = docutils.parsers.rst.directives.images.Image
+
+        class ImageDirective(Image):
+            option_spec = dict(Image.option_spec,
+                               mode=image_mode,
+                               colors=image_colors)
+        _image_directive = ImageDirective
+    return _image_directive
+
+def transition_name(argument):
+    return docutils.parsers.rst.directives.choice(
+        argument, sorted(UrwidTranslator.transition_map))
+
+def transition_duration(argument):
+    value = float(argument)
+    if value < 0:
+        raise ValueError('negative value; must be positive or zero')
+    return value
+
+def set_source_line(directive, node):
+    # Our nodes are checked after parsing (see lint.py); note where
+    # they came from so that problems can be reported there.
+    node.source, node.line = directive.state_machine.get_source_and_line(
+        directive.lineno)
+
 class TransitionDirective(docutils.parsers.rst.Directive):
     required_arguments = 1
-    option_spec = {'duration': float}
+    option_spec = {'duration': transition_duration}
     has_content = False
 
     def run(self):
-        args = {'name': self.arguments[0]}
+        try:
+            name = transition_name(self.arguments[0])
+        except ValueError, e:
+            raise self.error('Invalid transition: %s' % e)
+        args = {'name': name}
         duration = self.options.get('duration')
         if duration:
             args['duration'] = duration
@@ -386,26 +563,112 @@ class ANSIDirective(docutils.parsers.rst.Directive):
         args = {'names': self.arguments[0].split()}
         args.update(self.options)
         node = ansi(**args)
+        set_source_line(self, node)
+        return [node]
+
+class AnimationDirective(docutils.parsers.rst.Directive):
+    required_arguments = 1
+    final_argument_whitespace = True
+    option_spec = {'interval': float,
+                   'oneshot': docutils.parsers.rst.directives.flag,
+                   'lookahead': docutils.parsers.rst.directives.positive_int,
+                   'scale': docutils.parsers.rst.directives.percentage,
+                   'mode': image_mode,
+                   'colors': image_colors}
+    has_content = False
+
+    def run(self):
+        args = {'uri': docutils.parsers.rst.directives.uri(
+                self.arguments[0])}
+        args.update(self.options)
+        if 'oneshot' in self.options:
+            args['oneshot'] = True
+        node = animation(**args)
+        set_source_line(self, node)
+        return [node]
+
+class CodeDirective(docutils.parsers.rst.Directive):
+    """The code directive, with highlighting left to the translator.
+
+    Instead of an inline node for every token, the literal block holds
+    the code as text along with its language, and is highlighted from
+    the cache when it is translated.
+    """
+    optional_arguments = 1
+    option_spec = {'class': docutils.parsers.rst.directives.class_option,
+                   'name': docutils.parsers.rst.directives.unchanged,
+                   'number-lines': docutils.parsers.rst.directives.unchanged}
+    has_content = True
+
+    def run(self):
+        self.assert_has_content()
+        if self.arguments:
+            language = self.arguments[0]
+        else:
+            language = ''
+        docutils.parsers.rst.roles.set_classes(self.options)
+        classes = ['code']
+        if language:
+            classes.append(language)
+        if 'classes' in self.options:
+            classes.extend(self.options['classes'])
+        code = u'\n'.join(self.content)
+        settings = self.state.document.settings
+        if settings.syntax_highlight == 'none':
+            language = ''
+        try:
+            highlight.get_lexer(language)
+        except highlight.LexerError, e:
+            if settings.report_level <= 2:
+                raise self.warning(str(e))
+            language = ''
+        node = docutils.nodes.literal_block(code, code, classes=classes,
+                                            highlight=language)
+        if 'number-lines' in self.options:
+            try:
+                node['startline'] = int(self.options['number-lines'] or 1)
+            except ValueError:
+                raise self.error(':number-lines: with non-integer '
+                                 'start value')
+        self.add_name(node)
+        if 'source' in self.options:
+            node['source'] = self.options['source']
         return [node]
 
 class FigletDirective(docutils.parsers.rst.Directive):
     required_arguments = 1
+    option_spec = {'font': docutils.parsers.rst.directives.unchanged,
+                   'external': docutils.parsers.rst.directives.flag}
     has_content = False
     final_argument_whitespace = True
 
     def run(self):
         args = {'text': self.arguments[0]}
+        if 'font' in self.options:
+            args['font'] = self.options['font']
+        if 'external' in self.options:
+            args['external'] = True
         node = figlet(**args)
+        set_source_line(self, node)
         return [node]
 
 class CowsayDirective(docutils.parsers.rst.Directive):
     required_arguments = 1
+    option_spec = {'cow': docutils.parsers.rst.directives.unchanged,
+                   'width': docutils.parsers.rst.directives.positive_int,
+                   'external': docutils.parsers.rst.directives.flag}
     has_content = False
     final_argument_whitespace = True
 
     def run(self):
         args = {'text': self.arguments[0]}
+        for option in ['cow', 'width']:
+            if option in self.options:
+                args[option] = self.options[option]
+        if 'external' in self.options:
+            args['external'] = True
         node = cowsay(**args)
+        set_source_line(self, node)
         return [node]
 
 class HideTitleDirective(docutils.parsers.rst.Directive):
@@ -423,6 +686,10 @@ class ansi(docutils.nodes.General, docutils.nodes.Inline,
            docutils.nodes.Element):
     pass
 
+class animation(docutils.nodes.General, docutils.nodes.Inline,
+                docutils.nodes.Element):
+    pass
+
 class figlet(docutils.nodes.General, docutils.nodes.Inline,
              docutils.nodes.Element):
     pass
@@ -435,18 +702,238 @@ class hidetitle(docutils.nodes.Special, docutils.nodes.Invisible,
                 docutils.nodes.Element):
     pass
 
-class PresentationParser(object):
-    def __init__(self, palette, hinter=None):
-        docutils.parsers.rst.directives.register_directive(
-            'transition', TransitionDirective)
-        docutils.parsers.rst.directives.register_directive(
-            'ansi', ANSIDirective)
-        docutils.parsers.rst.directives.register_directive(
-            'figlet', FigletDirective)
-        docutils.parsers.rst.directives.register_directive(
-            'cowsay', CowsayDirective)
+ADORNMENT_CHARS = '!"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~'
+INCLUDE_RE = re.compile(r'^\.\.\s+include::\s*(\S.*?)\s*$')
+
+def _adornment(line):
+    # Returns the character of a section adornment line, if it is one.
+    line = line.rstrip()
+    if (len(line) >= 2 and line[0] in ADORNMENT_CHARS and
+        line == line[0] * len(line)):
+        return line[0]
+    return None
+
+def _long_enough(adornment, title):
+    # Like docutils, an adornment shorter than its title is only taken
+    # as one if it is at least four characters long.
+    adornment = adornment.rstrip()
+    return (len(adornment) >= 4 or
+            len(adornment) >= docutils.utils.column_width(title.strip()))
+
+def _title_styles(lines):
+    # Yields (index, style) for each section title at the start of a
+    # line, where index is the line the title's adornment starts on
+    # and style is (character, overlined).
+    previous_blank = True
+    i = 0
+    while i < len(lines) - 1:
+        line = lines[i]
+        if previous_blank and line and not line[0].isspace():
+            char = _adornment(line)
+            if (char and i + 2 < len(lines) and lines[i + 1].strip() and
+                _adornment(lines[i + 2]) == char and
+                _long_enough(line, lines[i + 1])):
+                yield (i, (char, True))
+                previous_blank = False
+                i += 3
+                continue
+            if (not char and _adornment(lines[i + 1]) and
+                _long_enough(lines[i + 1], line)):
+                yield (i, (_adornment(lines[i + 1]), False))
+                previous_blank = False
+                i += 2
+                continue
+        previous_blank = not line.strip()
+        i += 1
+
+def _expand_includes(lines, tab_width, seen=()):
+    # Replaces top-level include directives without options by the
+    # lines they include, so that their sections can be split apart.
+    ret = docutils.statemachine.StringList()
+    for i, line in enumerate(lines.data):
+        m = INCLUDE_RE.match(line)
+        if m and not (i + 1 < len(lines) and lines[i + 1][:1].isspace()):
+            path = m.group(1)
+            source = lines.source(i)
+            if not (path.startswith('<') or source is None):
+                path = os.path.join(os.path.dirname(source), path)
+                if os.path.exists(path) and path not in seen:
+                    with open(path) as f:
+                        data = unicode(f.read(), 'utf-8')
+                    included = docutils.statemachine.StringList(
+                        docutils.statemachine.string2lines(
+                            data, tab_width, convert_whitespace=True),
+                        path)
+                    ret.extend(_expand_includes(included, tab_width,
+                                                seen + (path,)))
+                    continue
+        ret.append(line, *lines.info(i))
+    return ret
+
+def _slice(lines, start, end):
+    # A slice of a StringList refers to the whole list; this copy does
+    # not, so that it is cheap to pickle.
+    return docutils.statemachine.StringList(lines.data[start:end],
+                                            items=lines.items[start:end])
+
+def split_sections(lines, chunks=None):
+    """Split the lines of a document before top-level sections.
+
+    Returns the lines before the first section and a list of the
+    lines of each section, or if chunks is given, of at most that many
+    runs of sections of about the same length.
+    """
+    titles = list(_title_styles(lines))
+    if not titles:
+        return lines, []
+    top = titles[0][1]
+    starts = [index for index, style in titles if style == top]
+    if chunks and len(starts) > chunks:
+        size = float(len(lines) - starts[0]) / chunks
+        grouped = []
+        for start in starts:
+            if (not grouped or
+                start - starts[0] >= size * len(grouped)):
+                grouped.append(start)
+        starts = grouped
+    preamble = _slice(lines, 0, starts[0])
+    sections = []
+    for start, end in zip(starts, starts[1:] + [len(lines)]):
+        sections.append(_slice(lines, start, end))
+    return preamble, sections
+
+# Directives which change how the rest of the document is parsed or
+# set something on the document itself.
+STATEFUL_RE = re.compile(
+    r'^\s*\.\.\s+(role|default-role|title|header|footer)::')
+
+def _reset_default_role():
+    # As docutils.parsers.rst.Parser.parse does, forget the default
+    # role set by a default-role directive once the document is parsed.
+    roles = getattr(docutils.parsers.rst.roles, '_roles', None)
+    if isinstance(roles, dict):
+        roles.pop('', None)
+
+class _SectionStateMachine(docutils.parsers.rst.states.RSTStateMachine):
+    # Keeps the section title styles in the order docutils found them,
+    # which it forgets at the end of the run.
+    title_styles = None
+
+    def runtime_init(self):
+        docutils.parsers.rst.states.RSTStateMachine.runtime_init(self)
+        self.title_styles = self.memo.title_styles
+
+def _run_parser(rst_parser, lines, document):
+    # docutils.parsers.rst.Parser.parse for lines which are already
+    # split (and remember where they came from).  Returns the section
+    # title styles, outermost first.
+    rst_parser.setup_parse(u'', document)
+    document.settings.setdefault('tab_width', 8)
+    document.settings.setdefault('syntax_highlight', 'long')
+    statemachine = _SectionStateMachine(
+        state_classes=rst_parser.state_classes,
+        initial_state=rst_parser.initial_state,
+        debug=document.reporter.debug_flag)
+    statemachine.run(lines, document, inliner=rst_parser.inliner)
+    _reset_default_role()
+    rst_parser.finish_parse()
+    return statemachine.title_styles
+
+def _parse_section(args):
+    """Parse a top-level section in a separate process.
+
+    The section is parsed after the document's preamble, so that roles
+    defined there are known, and the nodes and warnings from the
+    preamble are left out.  Returns the top-level nodes, the warnings,
+    the highlighted code blocks and the section title styles, in a form
+    that can be pickled.
+    """
+    filename, settings, palette, preamble, skip, lines = args
+    register_directives()
+    warnings = []
+    settings = copy.copy(settings)
+    settings.warning_stream = StringIO.StringIO()
+    document = docutils.utils.new_document(filename, settings)
+    preamble_lines = set([(preamble.source(i), preamble.offset(i) + 1)
+                          for i in range(len(preamble))])
+    reporter = document.reporter
+    def observe(msg):
+        if (msg['level'] >= reporter.report_level and
+            (msg.get('source'), msg.get('line')) not in preamble_lines):
+            warnings.append(msg.astext() + u'\n')
+    reporter.attach_observer(observe)
+    title_styles = _run_parser(docutils.parsers.rst.Parser(),
+                               preamble + lines, document)
+    nodes = document.children[skip:]
+    code = []
+    for node in document.traverse(docutils.nodes.literal_block):
+        if 'highlight' not in node:
+            continue
+        key = (node.astext(), node['highlight'], node.get('startline'))
+        try:
+            markup = highlight.highlight(key[0], key[1], palette, key[2])
+        except highlight.LexerError:
+            continue
+        code.append(key + (highlight.compact(markup),))
+    # Cut the nodes loose from this document so only they are pickled.
+    for node in nodes:
+        for child in node.traverse():
+            child._document = None
+        node.parent = None
+    return nodes, u''.join(warnings), code, title_styles
+
+def _sections_agree(document, title_styles, results):
+    """Whether sections parsed apart make the same nodes as one parse.
+
+    Each section only knows the names, ids and title styles of the
+    preamble, so the results only stand if no two of them used the
+    same name or id (which one parse would have told apart) and each
+    gave its title styles the levels the sections before it did.
+    """
+    names = set(document.nameids)
+    ids = set(document.ids)
+    title_styles = list(title_styles)
+    for nodes, warnings, code, styles in results:
+        if not (nodes and isinstance(nodes[0], docutils.nodes.section)):
+            return False
+        if styles[:len(title_styles)] != title_styles[:len(styles)]:
+            return False
+        title_styles.extend(styles[len(title_styles):])
+        section_names = set()
+        section_ids = set()
+        for node in nodes:
+            for child in node.traverse(docutils.nodes.Element):
+                section_names.update(child['names'])
+                section_names.update(child['dupnames'])
+                section_ids.update(child['ids'])
+        if section_names & names or section_ids & ids:
+            return False
+        names.update(section_names)
+        ids.update(section_ids)
+    return True
+
+def register_directives():
+    docutils.parsers.rst.directives.register_directive(
+        'transition', TransitionDirective)
+    docutils.parsers.rst.directives.register_directive(
+        'image', get_image_directive())
+    docutils.parsers.rst.directives.register_directive(
+        'ansi', ANSIDirective)
+    for name in ('code', 'code-block', 'sourcecode'):
         docutils.parsers.rst.directives.register_directive(
-            'hidetitle', HideTitleDirective)
+            name, CodeDirective)
+    docutils.parsers.rst.directives.register_directive(
+        'animation', AnimationDirective)
+    docutils.parsers.rst.directives.register_directive(
+        'figlet', FigletDirective)
+    docutils.parsers.rst.directives.register_directive(
+        'cowsay', CowsayDirective)
+    docutils.parsers.rst.directives.register_directive(
+        'hidetitle', HideTitleDirective)
+
+class PresentationParser(object):
+    def __init__(self, palette, hinter=None, graphics=None, jobs=1):
+        register_directives()
         self.warnings = StringIO.StringIO()
         self.settings = docutils.frontend.OptionParser(
             components=(docutils.parsers.rst.Parser,),
@@ -454,19 +941,147 @@ class PresentationParser(object):
         self.parser = docutils.parsers.rst.Parser()
         self.palette = palette
         self.hinter = hinter
-
-    def _parse(self, input, filename):
+        self.graphics = graphics
+        if not jobs:
+            jobs = multiprocessing.cpu_count()
+        self.jobs = jobs
+        self.search_index = None
+        palette_mod.ATTR_TABLE.compile(palette)
+
+    def _parseSections(self, input, filename):
+        # Returns the document, parsing its top-level sections in
+        # separate processes, or None if it is not worth doing so.
+        tab_width = self.settings.tab_width
+        lines = docutils.statemachine.StringList(
+            docutils.statemachine.string2lines(
+                input, tab_width, convert_whitespace=True),
+            filename)
+        for line in lines:
+            if len(line) > self.settings.line_length_limit:
+                return None
+        # A few chunks for each process evens out the work.
+        preamble, sections = split_sections(
+            _expand_includes(lines, tab_width), self.jobs * 4)
+        if len(sections) < 2:
+            return None
+        for section in sections:
+            for line in section:
+                if STATEFUL_RE.match(line):
+                    return None
         document = docutils.utils.new_document(filename, self.settings)
-        self.parser.parse(input, document)
+        title_styles = _run_parser(self.parser, preamble, document)
+        # The sections are parsed after the preamble, and the nodes it
+        # makes skipped.
+        skip = len(document.children)
+
+        settings = copy.copy(self.settings)
+        settings.warning_stream = None
+        pool = multiprocessing.Pool(min(self.jobs, len(sections)))
+        try:
+            results = pool.map(_parse_section,
+                               [(filename, settings, self.palette,
+                                 preamble, skip, section)
+                                for section in sections], chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        if not _sections_agree(document, title_styles, results):
+            return None
+        for nodes, warnings, code, styles in results:
+            self.warnings.write(warnings)
+            document.extend(nodes)
+            for text, language, startline, markup in code:
+                highlight.cache.put(text, language, self.palette, startline,
+                                    highlight.expand(markup))
+        return document
+
+    def _parse(self, input, filename, profile=None, stubs=False):
+        # If stubs is true, the program is made of SlideStubs to be
+        # built when they are needed.
+        if profile is None:
+            phase = lambda name: stats.NULL_TIMER
+        else:
+            phase = profile.phase
+        with phase('parse'):
+            document = None
+            if self.jobs > 1:
+                document = self._parseSections(input, filename)
+            if document is None:
+                document = docutils.utils.new_document(filename,
+                                                       self.settings)
+                self.parser.parse(input, document)
         visitor = UrwidTranslator(document, self.palette, self.hinter,
-                                  os.path.dirname(filename))
-        document.walkabout(visitor)
+                                  os.path.dirname(filename), profile,
+                                  self.graphics, stubs)
+        with phase('walk'):
+            document.walkabout(visitor)
+            # Let any external programs started for the slides finish
+            # so their failures are known when the load is done.
+            tools.runner.wait()
+        self.search_index = visitor.search_index
         return document, visitor
 
-    def parse(self, input, filename='program'):
-        document, visitor = self._parse(input, filename)
+    def parse(self, input, filename='program', profile=None):
+        document, visitor = self._parse(input, filename, profile)
         return visitor.program
 
+    def build(self, source):
+        """Build a slide from the SlideSource of an evicted slide."""
+        # This happens during the presentation, when forking a pool
+        # of processes (with the presentation's threads running) is
+        # not safe, so everything is parsed in this process.
+        visitor = UrwidTranslator(source.node.document, self.palette,
+                                  self.hinter, source.basedir,
+                                  graphics=self.graphics, jobs=1)
+        visitor.default_transition = source.default_transition
+        visitor.transition = source.default_transition
+        visitor.default_hide_title = source.default_hide_title
+        source.node.walkabout(visitor)
+        return visitor.program[-1]
+
+def add_jobs_argument(argp):
+    argp.add_argument('--jobs', dest='jobs', default=1, type=int,
+                      help='parse the top-level sections in this many '
+                      'processes (0 for one per CPU)')
+
+def add_profile_arguments(argp):
+    argp.add_argument('--profile-load', dest='profile_load',
+                      default=False, action='store_true',
+                      help='print a breakdown of load time and exit')
+    argp.add_argument('--profile-top', dest='profile_top',
+                      default=10, type=int,
+                      help='number of slowest slides and assets to list')
+    argp.add_argument('--profile-output', dest='profile_output',
+                      default=None,
+                      help='also write cProfile data to this file')
+
+def profile_parse(parser, input, filename, args, stubs=False):
+    """Parse a presentation as requested by add_profile_arguments.
+
+    Returns the document, translator and load profile (or None).  If
+    stubs is true, the slides are left unbuilt (see
+    PresentationParser.build).
+    """
+    profile = None
+    if args.profile_load:
+        profile = stats.LoadProfile()
+    profiler = None
+    if args.profile_output:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        document, visitor = parser._parse(input, filename, profile, stubs)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(args.profile_output)
+    return document, visitor, profile
+
+def profile_report(profile, args):
+    return u'%s\n\n%s' % (profile.getReport(args.profile_top),
+                           palette_mod.ATTR_TABLE.getReport())
+
 def main():
     import argparse
     import palette
@@ -477,10 +1092,19 @@ def main():
                       help='slides to render')
     argp.add_argument('--render', action='store_true',
                       help='Fully render a slide')
+    add_jobs_argument(argp)
+    add_profile_arguments(argp)
     args = argp.parse_args()
 
-    parser = PresentationParser(palette.DARK_PALETTE)
-    document, visitor = parser._parse(unicode(open(args.file).read(), 'utf-8'), args.file)
+    parser = PresentationParser(palette.DARK_PALETTE, jobs=args.jobs)
+    document, visitor, profile = profile_parse(
+        parser, unicode(open(args.file).read(), 'utf-8'), args.file, args)
+    if profile:
+        print profile_report(profile, args).encode('utf8')
+        return
+    failures = tools.runner.getSummary()
+    if failures:
+        print failures.encode('utf8')
 
     slides = args.slides
     if not slides:
@@ -488,7 +1112,7 @@ def main():
     slides = [int(x) for x in slides]
 
     if not args.render:
-        print document.pformat()
+        print document.pformat().encode('utf8')
         for i in slides:
             print '-'*80
             s = visitor.program[i]
@@ -0,0 +1,138 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import collections
+import math
+import re
+
+import docutils.nodes
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+# How much a word counts for each time it appears in each part of a
+# slide.
+TITLE_WEIGHT = 4.0
+BODY_WEIGHT = 1.0
+HANDOUT_WEIGHT = 0.5
+
+SKIPPED_NODES = (docutils.nodes.comment, docutils.nodes.system_message,
+                 docutils.nodes.substitution_definition,
+                 docutils.nodes.raw)
+
+def words(text):
+    return WORD_RE.findall(text.lower())
+
+class SearchIndex(object):
+    """An inverted index of the text of the slides.
+
+    Each word maps to the slides it appears in, with its weight in
+    each: the number of times it appears, counting words in the title
+    more and those in the handout notes less.  A query matches the
+    slides with all of its words; the last word may be incomplete
+    while it is being typed.  Matches are ranked by the sum of the
+    weights of the words, each scaled so that rarer words count more.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.size = 0
+        self.vocabulary = None
+
+    def add(self, index, node):
+        """Index the docutils section of the slide at index.
+
+        Sections within it are slides of their own and are left out.
+        """
+        weights = collections.defaultdict(float)
+        for child in node.children:
+            if isinstance(child, docutils.nodes.section):
+                continue
+            if isinstance(child, docutils.nodes.title):
+                self._addText(child, TITLE_WEIGHT, weights)
+            else:
+                self._addText(child, BODY_WEIGHT, weights)
+        for word, weight in weights.iteritems():
+            self.postings.setdefault(word, {})[index] = weight
+        self.size = max(self.size, index + 1)
+        self.vocabulary = None
+
+    def _addText(self, node, weight, weights):
+        if isinstance(node, docutils.nodes.Text):
+            for word in words(node.astext()):
+                weights[word] += weight
+            return
+        if isinstance(node, SKIPPED_NODES):
+            return
+        if 'handout' in node.get('classes', ()):
+            weight = min(weight, HANDOUT_WEIGHT)
+        if node.tagname in ('figlet', 'cowsay'):
+            # Their text is an attribute rather than a child.
+            for word in words(node['text']):
+                weights[word] += weight
+        for child in node.children:
+            self._addText(child, weight, weights)
+
+    def _scores(self, word):
+        # Returns {slide: score} for the slides with word.
+        postings = self.postings.get(word, {})
+        idf = math.log(1.0 + float(self.size) / max(len(postings), 1))
+        return dict([(slide, weight * idf)
+                     for slide, weight in postings.iteritems()])
+
+    def _prefixScores(self, prefix):
+        # The best score of the words starting with prefix.
+        if self.vocabulary is None:
+            self.vocabulary = sorted(self.postings)
+        i = bisect.bisect_left(self.vocabulary, prefix)
+        scores = {}
+        while (i < len(self.vocabulary) and
+               self.vocabulary[i].startswith(prefix)):
+            word = self.vocabulary[i]
+            i += 1
+            for slide, score in self._scores(word).iteritems():
+                if score > scores.get(slide, 0.0):
+                    scores[slide] = score
+        return scores
+
+    def search(self, query):
+        """Return the indexes of the slides matching query, best first."""
+        query = query.lower()
+        terms = words(query)
+        if not terms:
+            return []
+        prefix = None
+        if WORD_RE.match(query[-1]):
+            prefix = terms.pop()
+        scores = [self._scores(term) for term in set(terms)]
+        if prefix is not None:
+            scores.append(self._prefixScores(prefix))
+        # Start with the fewest matches so there is less to intersect.
+        scores.sort(key=len)
+        total = scores[0]
+        for other in scores[1:]:
+            total = dict([(slide, score + other[slide])
+                          for slide, score in total.iteritems()
+                          if slide in other])
+        return sorted(total, key=lambda slide: (-total[slide], slide))
+
+def index_program(program):
+    """Make a SearchIndex for slides which were not parsed with one."""
+    index = SearchIndex()
+    for i, s in enumerate(program):
+        source = getattr(s, 'source', None)
+        if source is not None:
+            index.add(i, source.node)
+    return index
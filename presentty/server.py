@@ -17,6 +17,11 @@ import os
 import threading
 import SocketServer
 
+import stats
+
+COMMANDS = ('list', 'current', 'next', 'prev', 'jump', 'search', 'size',
+            'stats', 'memory')
+
 class ConsoleHandler(SocketServer.StreamRequestHandler):
     def handle(self):
         server = self.server.server
@@ -27,31 +32,72 @@ class ConsoleHandler(SocketServer.StreamRequestHandler):
                 break
             if not data:
                 break
-            data = data.strip()
-            if data == 'list':
-                for i, slide in enumerate(server.list()):
-                    self.wfile.write('slide %i %s\n' % (i, slide.title))
-                self.wfile.write('end\n')
-            elif data == 'current':
-                i, slide = server.current()
-                self.wfile.write('current %i %i %s\n' % (
-                    i, slide.progressive_state, slide.title))
-            elif data == 'next':
-                i, slide = server.next()
-                self.wfile.write('current %i %i %s\n' % (
-                    i, slide.progressive_state, slide.title))
-            elif data == 'prev':
-                i, slide = server.prev()
-                self.wfile.write('current %i %i %s\n' % (
-                    i, slide.progressive_state, slide.title))
-            elif data.startswith('jump'):
-                parts = data.split()
-                i, slide = server.jump(int(parts[1].strip()))
-                self.wfile.write('current %i %i %s\n' % (
-                    i, slide.progressive_state, slide.title))
-            elif data == 'size':
-                size = server.size()
-                self.wfile.write('size %s %s\n' % size)
+            line = data.rstrip('\r\n')
+            data = line.strip()
+            if not data:
+                continue
+            name = data.split()[0]
+            if name not in COMMANDS:
+                # Clients should not be able to add timers at will.
+                name = 'unknown'
+            with stats.timer('command.' + name):
+                self.command(server, data, line)
+
+    def command(self, server, data, line):
+        # data is the command line without surrounding whitespace;
+        # line keeps any spaces at the end.
+        if data == 'list':
+            for i, slide in enumerate(server.list()):
+                self.wfile.write('slide %i %s\n' % (i, slide.title))
+            self.wfile.write('end\n')
+        elif data == 'current':
+            i, slide = server.current()
+            self.wfile.write('current %i %i %s\n' % (
+                i, slide.progressive_state, slide.title))
+        elif data == 'next':
+            i, slide = server.next()
+            self.wfile.write('current %i %i %s\n' % (
+                i, slide.progressive_state, slide.title))
+        elif data == 'prev':
+            i, slide = server.prev()
+            self.wfile.write('current %i %i %s\n' % (
+                i, slide.progressive_state, slide.title))
+        elif data.startswith('jump'):
+            parts = data.split()
+            i, slide = server.jump(int(parts[1].strip()))
+            self.wfile.write('current %i %i %s\n' % (
+                i, slide.progressive_state, slide.title))
+        elif data.split()[0] == 'search':
+            # A space at the end of the query ends its last word,
+            # which is otherwise matched as a prefix.
+            query = line.lstrip()[len('search'):]
+            query = unicode(query, 'utf-8', 'replace')
+            program = server.list()
+            for i in server.search(query):
+                self.wfile.write(('result %i %s\n' % (
+                    i, program[i].title)).encode('utf-8'))
+            self.wfile.write('end\n')
+        elif data == 'size':
+            size = server.size()
+            self.wfile.write('size %s %s\n' % size)
+        elif data == 'stats':
+            fps, frame, slowest, summary = server.stats()
+            if frame is None:
+                frame = '-'
+            else:
+                frame = '%f' % frame
+            if slowest is None:
+                slowest = '- -'
+            else:
+                slowest = '%s %f' % slowest
+            self.wfile.write('stats %.1f %s %s\n' % (fps, frame, slowest))
+            for name, count, total, high, last in summary:
+                self.wfile.write('stat %s %i %f %f %f\n' % (
+                    name, count, total, high, last))
+            self.wfile.write('end\n')
+        elif data == 'memory':
+            built, total, rss = server.memory()
+            self.wfile.write('memory %i %i %i\n' % (built, total, rss))
 
 class ThreadedTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
     allow_reuse_address=True
@@ -81,9 +127,20 @@ class ConsoleServer(object):
         s = self.presenter.program[self.presenter.pos]
         return (self.presenter.pos, s)
 
+    def search(self, query):
+        return self.presenter.getSearchIndex().search(query)
+
     def size(self):
         return self.presenter.loop.screen.get_cols_rows()
 
+    def memory(self):
+        return self.presenter.getMemoryUsage()
+
+    def stats(self):
+        recorder = stats.recorder
+        return (recorder.getFPS(), recorder.getLastFrame(),
+                recorder.getSlowest(), recorder.getSummary())
+
     def next(self):
         self.lock.acquire()
         try:
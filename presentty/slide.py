@@ -13,10 +13,125 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import weakref
+
 import urwid
 
-class SlidePile(urwid.Pile):
+import palette
+import stats
+
+def canvas_cells(canvas):
+    """Convert a canvas into rows of (attribute id, character) cells."""
+    rows = []
+    for line in canvas.content():
+        row = []
+        for (attr, cs, text) in line:
+            attr_id = palette.attr_id(attr)
+            for char in unicode(text, 'utf8'):
+                row.append((attr_id, char))
+        rows.append(row)
+    return rows
+
+class LayoutStats(object):
+    """Count pack()/rows() requests to slide containers and how many
+    of them actually had to be computed."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.computed = 0
+
+LAYOUT_STATS = LayoutStats()
+
+# Whether slide containers memoize their layout (the benchmark turns
+# this off for comparison).
+layout_cache_enabled = True
+
+# Incremented whenever something may have changed the size of every
+# widget (such as the screen being resized), which clears all
+# memoized layouts.
+layout_generation = 0
+
+class LayoutScope(object):
+    """The layout generation of the widgets of one slide.
+
+    A change inside a slide (an animation frame, for instance) only
+    clears the memoized layouts of that slide's containers.
+    """
+
+    def __init__(self):
+        self.generation = 0
+
+def invalidate_layout(scope=None):
+    global layout_generation
+    if scope is None:
+        layout_generation += 1
+    else:
+        scope.generation += 1
+
+def set_layout_scope(widget, scope):
+    """Make scope the layout scope of widget and everything in it."""
+    stack = [widget]
+    while stack:
+        w = stack.pop()
+        if isinstance(w, (LayoutCache, AnimatedText)):
+            w._layout_scope = scope
+        if isinstance(w, (urwid.Pile, urwid.Columns)):
+            stack.extend([child for (child, options) in w.contents])
+        elif isinstance(w, urwid.WidgetDecoration):
+            stack.append(w.original_widget)
+        elif isinstance(w, urwid.WidgetWrap):
+            stack.append(w._w)
+
+class LayoutCache(object):
+    """Memoize pack() and rows() of slide containers per size.
+
+    Slide contents are static once parsed, but urwid asks containers
+    for their size many times during a single render, and each answer
+    recurses through all of their children.
+    """
+
+    _layout_cache = None
+    _layout_generation = None
+    _layout_scope = None
+
+    def _invalidate(self):
+        invalidate_layout(self._layout_scope)
+        super(LayoutCache, self)._invalidate()
+
+    def _cachedLayout(self, key, fn, size, focus):
+        LAYOUT_STATS.calls += 1
+        if not layout_cache_enabled:
+            LAYOUT_STATS.computed += 1
+            return fn(size, focus)
+        generation = layout_generation
+        if self._layout_scope is not None:
+            generation = (generation, self._layout_scope.generation)
+        if (self._layout_cache is None or
+            self._layout_generation != generation):
+            self._layout_cache = {}
+            self._layout_generation = generation
+        key = (key, tuple(size), focus)
+        try:
+            return self._layout_cache[key]
+        except KeyError:
+            pass
+        LAYOUT_STATS.computed += 1
+        ret = fn(size, focus)
+        self._layout_cache[key] = ret
+        return ret
+
     def pack(self, size, focus=False):
+        return self._cachedLayout('pack', self._pack, size, focus)
+
+    def rows(self, size, focus=False):
+        return self._cachedLayout('rows', super(LayoutCache, self).rows,
+                                  size, focus)
+
+class SlidePile(LayoutCache, urwid.Pile):
+    def _pack(self, size, focus=False):
         cols = 0
         rows = 0
         for x in self.contents:
@@ -26,15 +141,15 @@ class SlidePile(urwid.Pile):
             rows += r
         return (cols, rows)
 
-class SlidePadding(urwid.Padding):
-    def pack(self, size, focus=False):
+class SlidePadding(LayoutCache, urwid.Padding):
+    def _pack(self, size, focus=False):
         r = self._original_widget.pack(size, focus)
         width = max(r[0] + self.left + self.right, self.min_width)
         width = min(size[0], width)
         return (width, r[1])
 
-class SlideColumns(urwid.Columns):
-    def pack(self, size, focus=False):
+class SlideColumns(LayoutCache, urwid.Columns):
+    def _pack(self, size, focus=False):
         cols = self.dividechars * (len(self.contents)-1)
         rows = 0
         for widget, packing in self.contents:
@@ -58,13 +173,41 @@ class ScreenHinter(object):
     # image widget.
     def __init__(self, screen=None):
         self.screen = screen
+        self.size = None
+        self.listeners = []
+        self.widgets = weakref.WeakSet()
 
     def setScreen(self, screen):
         self.screen = screen
+        self.resized()
+
+    def subscribe(self, callback):
+        """Call callback (with no arguments) whenever the screen is resized."""
+        self.listeners.append(callback)
+
+    def subscribeWidget(self, widget):
+        """Call widget.screenResized() whenever the screen is resized,
+        for as long as the widget is otherwise in use."""
+        self.widgets.add(widget)
+
+    def resized(self):
+        """Note that the screen may have changed size.
+
+        The size is cached since it is needed by every image layout,
+        and querying a terminal for it is relatively expensive.
+        """
+        self.size = None
+        invalidate_layout()
+        for callback in self.listeners:
+            callback()
+        for widget in list(self.widgets):
+            widget.screenResized()
 
     def getSize(self):
-        cols, rows = self.screen.get_cols_rows()
-        return (cols, rows-1)
+        if self.size is None:
+            cols, rows = self.screen.get_cols_rows()
+            self.size = (cols, rows-1)
+        return self.size
 
 class Handout(urwid.WidgetWrap):
     def __init__(self, widget, background):
@@ -73,9 +216,18 @@ class Handout(urwid.WidgetWrap):
         self.map = urwid.AttrMap(self.pad, self.background)
         super(Handout, self).__init__(self.map)
 
+class SlideStub(object):
+    """Stands in for a slide whose widgets have been evicted."""
+    def __init__(self, title, source):
+        self.title = title
+        self.source = source
+        self.handout = None
+        self.progressive_state = 0
+
 class UrwidSlide(urwid.WidgetWrap):
     def __init__(self, title, transition, widget, background):
         self.title = title
+        self.source = None
         self.transition = transition
         self.fill = SlideFiller(widget)
         self.background = background
@@ -85,8 +237,70 @@ class UrwidSlide(urwid.WidgetWrap):
         self.progressives = []
         self.progressive_attr = None
         self.progressive_state = 0
+        self._cells = None
+        self._cells_canvas = None
+        # Final canvases by (size, progressive state).
+        self._layouts = {}
         super(UrwidSlide, self).__init__(self.map)
 
+    def scopeLayout(self):
+        """Give the widgets of this slide (and its handout) their own
+        layout scope; call once the slide is complete."""
+        scope = LayoutScope()
+        set_layout_scope(self.map, scope)
+        if self.handout is not None:
+            set_layout_scope(self.handout, scope)
+
+    def _getLayout(self, size, focus=False):
+        size = tuple(size)
+        key = (size, self.progressive_state)
+        if self.animations:
+            # Keep a reference to the latest canvas of an animated
+            # slide.  That keeps the canvases of its static widgets in
+            # urwid's cache, so only the animated widgets are rendered
+            # again on the next frame.
+            canvas = super(UrwidSlide, self).render(size, focus)
+            self._layouts = {key: canvas}
+            return canvas
+        canvas = self._layouts.get(key)
+        if canvas is None:
+            canvas = super(UrwidSlide, self).render(size, focus)
+            self._layouts[key] = canvas
+        return canvas
+
+    def render(self, size, focus=False):
+        with stats.timer('UrwidSlide.render'):
+            return self._getLayout(size, focus)
+
+    def layout(self, size):
+        """Compute and store the final canvas of every progressive state.
+
+        Slide content is static once parsed, so after this the slide
+        can be displayed at this size without rendering any widget.
+        Layouts for other sizes are discarded.
+        """
+        size = tuple(size)
+        for key in self._layouts.keys():
+            if key[0] != size:
+                del self._layouts[key]
+        if self.animations:
+            return
+        state = self.progressive_state
+        for i in range(len(self.progressives)+1):
+            if (size, i) not in self._layouts:
+                self.setProgressive(i)
+                self._getLayout(size)
+        self.setProgressive(state)
+
+    def getCells(self, size):
+        """Return the slide rendered as rows of cells (see canvas_cells)."""
+        canvas = self._getLayout(size)
+        # This is the same canvas until the slide changes.
+        if canvas is not self._cells_canvas:
+            self._cells = canvas_cells(canvas)
+            self._cells_canvas = canvas
+        return self._cells
+
     def startAnimation(self, loop):
         for x in self.animations:
             x.startAnimation(loop)
@@ -134,6 +348,8 @@ class UrwidSlide(urwid.WidgetWrap):
                 x.set_attr_map({None: self.progressive_attr})
 
 class AnimatedText(urwid.Text):
+    _layout_scope = None
+
     def __init__(self, interval=0.5, oneshot=False):
         super(AnimatedText, self).__init__(u'')
         self.frames = []
@@ -142,6 +358,11 @@ class AnimatedText(urwid.Text):
         self.interval = interval
         self.oneshot = oneshot
 
+    def _invalidate(self):
+        # A new frame may have a different size.
+        invalidate_layout(self._layout_scope)
+        super(AnimatedText, self)._invalidate()
+
     def addFrame(self, text):
         self.frames.append(text)
         if len(self.frames) == self.current+1:
@@ -158,6 +379,12 @@ class AnimatedText(urwid.Text):
     def updateCallback(self, loop=None, data=None):
         if not self.running:
             return
+        with stats.timer('AnimatedText.tick'):
+            self._tick()
+        if self.running:
+            loop.set_alarm_in(self.interval, self.updateCallback)
+
+    def _tick(self):
         if self.current+1 >= len(self.frames):
             if self.oneshot:
                 self.running = False
@@ -166,7 +393,6 @@ class AnimatedText(urwid.Text):
         else:
             self.current += 1
         self.set_text(self.frames[self.current])
-        loop.set_alarm_in(self.interval, self.updateCallback)
 
     def stopAnimation(self):
         if not self.running:
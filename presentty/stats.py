@@ -0,0 +1,195 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import threading
+import time
+
+class Timer(object):
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, etype, value, tb):
+        self.record(self.name, time.time() - self.start)
+        return False
+
+class NullTimer(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, tb):
+        return False
+
+NULL_TIMER = NullTimer()
+
+class Recorder(object):
+    """Record timings of hot paths into a fixed-size ring buffer.
+
+    Recording is off by default so that the instrumented code paths
+    cost no more than an attribute check when nobody is watching.
+    """
+
+    def __init__(self, size=512):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.events = collections.deque(maxlen=size)
+        self.frames = collections.deque(maxlen=size)
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+            self.frames.clear()
+
+    def timer(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self.record, name)
+
+    def record(self, name, duration):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.events.append((time.time(), name, duration))
+
+    def frame(self, duration):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.frames.append((time.time(), duration))
+
+    def getFPS(self, window=1.0):
+        with self.lock:
+            frames = list(self.frames)
+        if not frames:
+            return 0.0
+        cutoff = frames[-1][0] - window
+        count = len([f for f in frames if f[0] >= cutoff])
+        return count / window
+
+    def getLastFrame(self):
+        with self.lock:
+            if not self.frames:
+                return None
+            return self.frames[-1][1]
+
+    def getSlowest(self, suffix='.render'):
+        """Return the (name, duration) of the slowest widget render."""
+        with self.lock:
+            events = [e for e in self.events if e[1].endswith(suffix)]
+        if not events:
+            return None
+        when, name, duration = max(events, key=lambda e: e[2])
+        return (name, duration)
+
+    def getSummary(self):
+        """Return a list of (name, count, total, max, last) per event name."""
+        with self.lock:
+            events = list(self.events)
+        summary = collections.OrderedDict()
+        for when, name, duration in events:
+            count, total, high, last = summary.get(name, (0, 0.0, 0.0, 0.0))
+            summary[name] = (count + 1, total + duration,
+                             max(high, duration), duration)
+        return [(name,) + values for name, values in summary.items()]
+
+    def getOverlayText(self):
+        last = self.getLastFrame()
+        slowest = self.getSlowest()
+        lines = ['fps: %.1f' % self.getFPS()]
+        if last is None:
+            lines.append('frame: -')
+        else:
+            lines.append('frame: %.1fms' % (last * 1000))
+        if slowest is None:
+            lines.append('slowest: -')
+        else:
+            lines.append('slowest: %s %.1fms' % (slowest[0],
+                                                 slowest[1] * 1000))
+        return u'\n'.join(lines)
+
+class LoadProfile(object):
+    """Break down the time spent loading a presentation.
+
+    Phases (such as the docutils parse and the translator walk) are
+    timed as a whole, and the walk is further broken down per slide
+    and per asset (images, ANSI art, figlet and cowsay output).
+    """
+
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        self.slides = []
+        self.assets = []
+        self._slide_assets = 0.0
+
+    def phase(self, name):
+        return Timer(self._recordPhase, name)
+
+    def _recordPhase(self, name, duration):
+        self.phases[name] = self.phases.get(name, 0.0) + duration
+
+    def asset(self, kind, name):
+        return Timer(self._recordAsset, (kind, name))
+
+    def _recordAsset(self, name, duration):
+        kind, name = name
+        self.assets.append((duration, kind, name))
+        self._slide_assets += duration
+
+    def slideStarted(self):
+        self._slide_assets = 0.0
+
+    def slideFinished(self, index, title, duration):
+        self.slides.append((duration, self._slide_assets, index, title))
+        self._slide_assets = 0.0
+
+    def getReport(self, top=10):
+        lines = []
+        total = sum(self.phases.values())
+        asset_time = sum([a[0] for a in self.assets])
+        lines.append('Load time: %.3fs' % total)
+        for name, duration in self.phases.items():
+            lines.append('  %-20s %8.3fs' % (name, duration))
+        if 'walk' in self.phases:
+            lines.append('    %-18s %8.3fs' % (
+                'widget build', self.phases['walk'] - asset_time))
+            lines.append('    %-18s %8.3fs' % ('asset render', asset_time))
+        lines.append('')
+        lines.append('Slowest slides:')
+        for duration, assets, index, title in sorted(
+                self.slides, reverse=True)[:top]:
+            lines.append(u'  %8.3fs  (assets %.3fs)  #%i %s' % (
+                duration, assets, index, title))
+        lines.append('')
+        lines.append('Slowest assets:')
+        for duration, kind, name in sorted(self.assets, reverse=True)[:top]:
+            name = u' '.join(name.split())
+            if len(name) > 60:
+                name = name[:57] + u'...'
+            lines.append(u'  %8.3fs  %-8s %s' % (duration, kind, name))
+        return u'\n'.join(lines)
+
+recorder = Recorder()
+
+def timer(name):
+    return recorder.timer(name)
@@ -0,0 +1,107 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import base64
+import cStringIO as StringIO
+import random
+import unittest
+
+import PIL.Image
+
+from presentty import graphics
+
+class TestSixel(unittest.TestCase):
+    def test_solid(self):
+        image = PIL.Image.new('RGB', (3, 2), (255, 0, 0))
+        self.assertEqual(graphics.encode_sixel(image),
+                         '\x1bP0;1;0q"1;1;3;2'
+                         '#0;2;100;0;0'
+                         '#0BBB-'
+                         '\x1b\\')
+
+    def test_run_length(self):
+        image = PIL.Image.new('RGB', (8, 1), (0, 255, 0))
+        self.assertEqual(graphics.encode_sixel(image),
+                         '\x1bP0;1;0q"1;1;8;1'
+                         '#0;2;0;100;0'
+                         '#0!8@-'
+                         '\x1b\\')
+
+    def test_bands(self):
+        # A white left column and bottom row on blue, eight rows high
+        # so that it takes two bands of sixels.
+        image = PIL.Image.new('RGB', (4, 8), (0, 0, 255))
+        for y in range(8):
+            image.putpixel((0, y), (255, 255, 255))
+        for x in range(4):
+            image.putpixel((x, 7), (255, 255, 255))
+        self.assertEqual(graphics.encode_sixel(image),
+                         '\x1bP0;1;0q"1;1;4;8'
+                         '#0;2;100;100;100#1;2;0;0;100'
+                         '#0~$#1?~~~-'
+                         '#0BAAA$#1?@@@-'
+                         '\x1b\\')
+
+class TestKitty(unittest.TestCase):
+    def _payload(self, image):
+        buf = StringIO.StringIO()
+        image.save(buf, 'PNG')
+        return base64.b64encode(buf.getvalue())
+
+    def _decode(self, data):
+        return PIL.Image.open(StringIO.StringIO(base64.b64decode(data)))
+
+    def test_single_chunk(self):
+        image = PIL.Image.new('RGB', (2, 2), (255, 0, 0))
+        data = self._payload(image)
+        self.assertTrue(len(data) <= graphics.KITTY_CHUNK)
+        self.assertEqual(graphics.encode_kitty(image, 3),
+                         '\x1b_Ga=t,f=100,i=3,q=2,m=0;%s\x1b\\' % data)
+
+    def test_chunks(self):
+        # Noise does not compress, so this takes several chunks.
+        rand = random.Random(0)
+        image = PIL.Image.new('RGB', (48, 48))
+        image.putdata([(rand.randrange(256), rand.randrange(256),
+                        rand.randrange(256)) for i in range(48 * 48)])
+        data = self._payload(image)
+        size = graphics.KITTY_CHUNK
+        self.assertEqual(len(data) // size, 2)
+        self.assertEqual(graphics.encode_kitty(image, 7),
+                         '\x1b_Ga=t,f=100,i=7,q=2,m=1;%s\x1b\\'
+                         '\x1b_Gm=1;%s\x1b\\'
+                         '\x1b_Gm=0;%s\x1b\\' % (data[:size],
+                                                 data[size:size * 2],
+                                                 data[size * 2:]))
+        self.assertEqual(list(self._decode(data).getdata()),
+                         list(image.getdata()))
+
+    def test_convert(self):
+        # Other modes are sent as RGB.
+        image = PIL.Image.new('RGBA', (2, 1), (0, 0, 255, 128))
+        output = graphics.encode_kitty(image, 1)
+        prefix = '\x1b_Ga=t,f=100,i=1,q=2,m=0;'
+        self.assertTrue(output.startswith(prefix))
+        self.assertTrue(output.endswith('\x1b\\'))
+        decoded = self._decode(output[len(prefix):-2])
+        self.assertEqual(decoded.mode, 'RGB')
+        self.assertEqual(list(decoded.getdata()), [(0, 0, 255)] * 2)
+
+    def test_place(self):
+        self.assertEqual(graphics.kitty_place(7, 10, 4),
+                         '\x1b_Ga=p,i=7,c=10,r=4,C=1,q=2\x1b\\')
+
+if __name__ == '__main__':
+    unittest.main()
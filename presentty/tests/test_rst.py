@@ -0,0 +1,109 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import docutils.utils
+
+from presentty import palette
+from presentty import rst
+
+PLAIN = u"""\
+One
+===
+
+Some *text* here.
+
+Two
+===
+
+More ``code`` there.
+
+Three
+=====
+
+Sub
+---
+
+The end.
+"""
+
+DEFAULT_ROLE = u"""\
+One
+===
+
+.. default-role:: literal
+
+Some `code` here.
+
+Two
+===
+
+More `code` there.
+"""
+
+DUPLICATE_NAMES = u"""\
+One
+===
+
+Same
+----
+
+Two
+===
+
+Same
+----
+"""
+
+TITLE_LEVELS = u"""\
+One
+===
+
+Sub one
+-------
+
+Two
+===
+
+Sub two
+~~~~~~~
+"""
+
+class TestParseSections(unittest.TestCase):
+    def parse(self, text, jobs):
+        parser = rst.PresentationParser(palette.DARK_PALETTE, jobs=jobs)
+        try:
+            document, visitor = parser._parse(text, '<test>')
+        except docutils.utils.SystemMessage as e:
+            return str(e)
+        return document.pformat()
+
+    def assertSameParse(self, text):
+        self.assertEqual(self.parse(text, 1), self.parse(text, 2))
+
+    def test_plain(self):
+        parser = rst.PresentationParser(palette.DARK_PALETTE, jobs=2)
+        self.assertIsNotNone(parser._parseSections(PLAIN, '<test>'))
+        self.assertSameParse(PLAIN)
+
+    def test_default_role(self):
+        self.assertSameParse(DEFAULT_ROLE)
+
+    def test_duplicate_names(self):
+        self.assertSameParse(DUPLICATE_NAMES)
+
+    def test_title_levels(self):
+        self.assertSameParse(TITLE_LEVELS)
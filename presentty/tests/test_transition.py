@@ -0,0 +1,74 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import urwid
+
+from presentty import palette
+from presentty import transition
+
+class TestCellGrid(unittest.TestCase):
+    def setUp(self):
+        self.encoding = urwid.get_encoding_mode()
+        urwid.set_encoding('utf8')
+        self.red = palette.attr('light red', 'black')
+        self.blue = palette.attr('light blue', 'black')
+        canvas = urwid.Text([(self.red, u'a\u65e5\u672c'),
+                             (self.blue, u'\u00e9b')]).render((8,))
+        self.grid = transition.CellGrid(canvas)
+
+    def tearDown(self):
+        urwid.set_encoding(self.encoding)
+
+    def slice(self, start, end):
+        text, attrs = self.grid.slice(0, start, end)
+        return (unicode(text, 'utf8'),
+                [(palette.ATTR_TABLE.by_id[attr_id], length)
+                 for attr_id, length in attrs])
+
+    def test_whole(self):
+        self.assertEqual(self.slice(0, 8),
+                         (u'a\u65e5\u672c\u00e9b ',
+                          [(self.red, 7), (self.blue, 3),
+                           (palette.ATTR_TABLE.getDefault(), 1)]))
+
+    def test_wide(self):
+        # Columns 1-2 and 3-4 are each one wide character.
+        self.assertEqual(self.slice(1, 5),
+                         (u'\u65e5\u672c', [(self.red, 6)]))
+        self.assertEqual(self.slice(2, 6),
+                         (u' \u672c\u00e9', [(self.red, 4),
+                                            (self.blue, 2)]))
+        self.assertEqual(self.slice(0, 2),
+                         (u'a ', [(self.red, 2)]))
+        self.assertEqual(self.slice(2, 3),
+                         (u' ', [(self.red, 1)]))
+
+    def test_wipe(self):
+        wipe = transition.WipeTransition()
+        for progress in range(9):
+            wipe.setProgress(progress / 8.0)
+            for grid, start, end in wipe.getSegments(0, 8, 1, self.grid,
+                                                     self.grid):
+                text, attrs = self.grid.slice(0, start, end)
+                text = unicode(text, 'utf8')
+                self.assertEqual(urwid.util.calc_width(text, 0, len(text)),
+                                 end - start)
+                self.assertEqual(sum([length for a, length in attrs]),
+                                 len(text.encode('utf8')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -13,73 +13,106 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import subprocess
-
 import urwid
 
-class FigletText(urwid.WidgetWrap):
-    def __init__(self, text, attr=None):
+import cowsay
+import figlet
+import tools
+
+class ToolText(urwid.WidgetWrap):
+    """Text generated by a built-in renderer or an external program.
+
+    External programs are run in the background by the tool runner;
+    the output is picked up the first time the widget is laid out.
+    """
+
+    tool = None
+
+    def __init__(self, text, attr=None, external=False):
         self.text = text
         self.attr = attr
-        output = self._run()
-        if attr:
-            widget = urwid.Text((attr, output), wrap='clip')
-        else:
-            widget = urwid.Text(output, wrap='clip')
-        super(FigletText, self).__init__(widget)
-
-    def _run(self):
+        self._call = None
+        output = None
+        if not external:
+            output = self._render()
+        if output is None:
+            self._call = tools.runner.submit(self._command(),
+                                             self.text.encode('utf8'),
+                                             description=self.text)
+            output = ''
+        super(ToolText, self).__init__(self._makeText(output))
+
+    def _makeText(self, output):
+        if self.attr:
+            return urwid.Text((self.attr, output), wrap='clip')
+        return urwid.Text(output, wrap='clip')
+
+    def _resolve(self):
+        if self._call is None:
+            return
+        output = self._call.result()
+        self._call = None
+        if output is None:
+            output = "[Unable to run %s]" % self.tool
+        self._w = self._makeText(output)
+
+    def render(self, size, focus=False):
+        self._resolve()
+        return super(ToolText, self).render(size, focus)
+
+    def rows(self, size, focus=False):
+        self._resolve()
+        return super(ToolText, self).rows(size, focus)
+
+    def pack(self, size=None, focus=False):
+        self._resolve()
+        return super(ToolText, self).pack(size, focus)
+
+class FigletText(ToolText):
+    tool = 'figlet'
+
+    def __init__(self, text, attr=None, font=None, external=False):
+        self.font = font
+        super(FigletText, self).__init__(text, attr, external)
+
+    def _render(self):
+        # Render with the built-in FIGfont renderer; returns None if
+        # the font is not available so that figlet can be tried.
         try:
-            p = subprocess.Popen(['figlet'],
-                                 stdin=subprocess.PIPE,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-        except OSError, e:
-            if e.errno == 2:
-                print("ERROR: figlet is used but is not installed.")
-            else:
-                print("ERROR: unable to run figlet: %s" % e)
-            raw_input("Press ENTER to continue.")
-            data = "[Unable to run figlet]"
-        else:
-            p.stdin.write(self.text)
-            p.stdin.close()
-            data = p.stdout.read()
-            p.stderr.read()
-            p.wait()
-        return data
-
-class CowsayText(urwid.WidgetWrap):
-    def __init__(self, text, attr=None):
-        self.text = text
-        self.attr = attr
-        output = self._run()
-        if attr:
-            widget = urwid.Text((attr, output), wrap='clip')
-        else:
-            widget = urwid.Text(output, wrap='clip')
-        super(CowsayText, self).__init__(widget)
-
-    def _run(self):
+            return figlet.render(self.text, self.font)
+        except figlet.FontError:
+            return None
+
+    def _command(self):
+        command = ['figlet']
+        if self.font:
+            command += ['-f', self.font]
+        return command
+
+class CowsayText(ToolText):
+    tool = 'cowsay'
+
+    def __init__(self, text, attr=None, cow=None, width=None,
+                 external=False):
+        self.cow = cow
+        self.width = width
+        super(CowsayText, self).__init__(text, attr, external)
+
+    def _render(self):
+        # Render with the built-in cowsay; returns None if the cowfile
+        # can not be used so that cowsay can be tried.
         try:
-            p = subprocess.Popen(['cowsay'],
-                                 stdin=subprocess.PIPE,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-        except OSError, e:
-            if e.errno == 2:
-                print("ERROR: cowsay is used but is not installed.")
-            else:
-                print("ERROR: unable to run cowsay: %s" % e)
-            raw_input("Press ENTER to continue.")
-            data = "[Unable to run cowsay]"
-        else:
-            p.stdin.write(self.text)
-            p.stdin.close()
-            data = p.stdout.read()
-            p.stderr.read()
-            p.wait()
-        return data
+            return cowsay.render(self.text, self.cow, self.width)
+        except cowsay.CowError:
+            return None
+
+    def _command(self):
+        command = ['cowsay']
+        if self.cow:
+            command += ['-f', self.cow]
+        if self.width:
+            command += ['-W', str(self.width)]
+        return command
 
 def main():
     import slide
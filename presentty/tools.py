@@ -0,0 +1,195 @@
+# Copyright (C) 2015 James E. Blair <corvus@gnu.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import collections
+import os
+import subprocess
+import threading
+
+class ToolCall(object):
+    """A single run of an external program.
+
+    The program runs in its own thread; result() waits for it and
+    returns its output, or None if it could not be run.  The input may
+    be a function returning it, which is called in that thread.
+    """
+
+    def __init__(self, runner, command, input, timeout, description):
+        self.runner = runner
+        self.command = command
+        self.input = input
+        self.timeout = timeout
+        self.description = description
+        self.output = None
+        self.done = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run,
+                                       name="Tool %s" % self.command[0])
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        with self.runner.semaphore:
+            try:
+                self.output = self._execute()
+            except Exception, e:
+                self.runner.fail(self.command[0], "unable to run %s: %s" %
+                                 (self.command[0], e), self.description)
+            finally:
+                # The input may be large, or refer to its widget.
+                self.input = None
+                self.done.set()
+
+    def _execute(self):
+        input = self.input
+        if callable(input):
+            input = input()
+        try:
+            # No preexec_fn: running Python code in the child of a
+            # threaded process can deadlock it.
+            p = subprocess.Popen(self.command,
+                                 stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE,
+                                 close_fds=True)
+        except OSError, e:
+            if e.errno == 2:
+                self.runner.setAvailable(self.command[0], False)
+                self.runner.fail(self.command[0], "%s is used but is not "
+                                 "installed" % self.command[0],
+                                 self.description)
+            else:
+                self.runner.fail(self.command[0], "unable to run %s: %s" %
+                                 (self.command[0], e), self.description)
+            return None
+        expired = []
+        def kill():
+            expired.append(True)
+            try:
+                p.kill()
+            except OSError:
+                pass
+        timer = threading.Timer(self.timeout, kill)
+        timer.start()
+        try:
+            output = p.communicate(input)[0]
+        finally:
+            timer.cancel()
+        if expired:
+            self.runner.fail(self.command[0], "%s timed out after %ss" %
+                             (self.command[0], self.timeout),
+                             self.description)
+            return None
+        return output
+
+    def result(self):
+        self.done.wait()
+        return self.output
+
+class ToolRunner(object):
+    """Run external programs (figlet, cowsay, jp2a) for the presentation.
+
+    Calls run concurrently (up to a limit) and each is killed if it
+    takes longer than its timeout.  Whether a program is installed is
+    only checked once, and rather than interrupting the load for each
+    problem, failures are collected so that they can be reported
+    together with getSummary().
+    """
+
+    def __init__(self, jobs=4, timeout=30):
+        self.timeout = timeout
+        self.semaphore = threading.Semaphore(jobs)
+        self.lock = threading.Lock()
+        self.available = {}
+        self.failures = collections.OrderedDict()
+        self.pending = []
+
+    def isAvailable(self, tool):
+        with self.lock:
+            available = self.available.get(tool)
+        if available is None:
+            available = False
+            for path in os.environ.get('PATH', os.defpath).split(os.pathsep):
+                fn = os.path.join(path, tool)
+                if os.path.isfile(fn) and os.access(fn, os.X_OK):
+                    available = True
+                    break
+            self.setAvailable(tool, available)
+        return available
+
+    def setAvailable(self, tool, available):
+        with self.lock:
+            self.available[tool] = available
+
+    def fail(self, tool, message, description=None):
+        with self.lock:
+            descriptions = self.failures.setdefault((tool, message), [])
+            if description and description not in descriptions:
+                descriptions.append(description)
+
+    def check(self, tool, description=None):
+        """Return whether tool is installed, noting a failure if not."""
+        if self.isAvailable(tool):
+            return True
+        self.fail(tool, "%s is used but is not installed" % tool, description)
+        return False
+
+    def submit(self, command, input=None, timeout=None, description=None):
+        """Start running command in the background and return a ToolCall."""
+        call = ToolCall(self, command, input, timeout or self.timeout,
+                        description)
+        if not self.check(command[0], description):
+            call.done.set()
+            return call
+        with self.lock:
+            self.pending = [c for c in self.pending if not c.done.is_set()]
+            self.pending.append(call)
+        call.start()
+        return call
+
+    def run(self, command, input=None, timeout=None, description=None):
+        return self.submit(command, input, timeout, description).result()
+
+    def wait(self):
+        """Wait for all of the calls started so far to finish."""
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+        for call in pending:
+            call.result()
+
+    def getSummary(self, clear=True):
+        """Return a report of the failures so far, or None if none."""
+        with self.lock:
+            failures = self.failures.items()
+            if clear:
+                self.failures.clear()
+        if not failures:
+            return None
+        lines = []
+        for (tool, message), descriptions in failures:
+            lines.append("ERROR: %s" % message)
+            for description in descriptions[:5]:
+                description = u' '.join(description.split())
+                if len(description) > 60:
+                    description = description[:57] + u'...'
+                lines.append(u"  %s" % description)
+            if len(descriptions) > 5:
+                lines.append("  (and %i more)" % (len(descriptions) - 5))
+        return u'\n'.join(lines)
+
+runner = ToolRunner()
@@ -13,8 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
+import math
+
 import urwid
 
+import palette
+import stats
+
 class Transition(urwid.Widget):
     def __init__(self, duration=0.4):
         super(Transition, self).__init__()
@@ -35,10 +41,53 @@ class Transition(urwid.Widget):
         self.progress = progress
         self._invalidate()
 
-class PanTransition(Transition):
+class BufferedTransition(Transition):
+    """A transition that works from snapshots of its slides.
+
+    Both slides are rendered once (per screen size) after the targets
+    are set, and each frame is assembled from those snapshots without
+    rendering any widget again.
+    """
+
+    def __init__(self, *args, **kw):
+        super(BufferedTransition, self).__init__(*args, **kw)
+        self._canvases = None
+        self._cache_size = None
+        self._cells = None
+        self._cells_size = None
+
+    def setTargets(self, old, new):
+        # Always take a fresh snapshot; the slides may be in a different
+        # progressive state than last time.
+        self._canvases = None
+        self._cache_size = None
+        self._cells = None
+        self._cells_size = None
+        super(BufferedTransition, self).setTargets(old, new)
+
+    def getCanvases(self, size):
+        """Return the rendered (old, new) canvases."""
+        if self._cache_size != size:
+            self._canvases = (self.old.render((size[0], size[1])),
+                              self.new.render((size[0], size[1])))
+            self._cache_size = size
+        return self._canvases
+
+    def getCells(self, size):
+        """Return the (old, new) slides as rows of cells."""
+        if self._cells_size != size:
+            self._cells = (self.old.getCells((size[0], size[1])),
+                           self.new.getCells((size[0], size[1])))
+            self._cells_size = size
+        return self._cells
+
+class PanTransition(BufferedTransition):
     def render(self, size, focus=False):
-        old = self.old.render((size[0], size[1]))
-        new = self.new.render((size[0], size[1]))
+        with stats.timer('PanTransition.render'):
+            return self._render(size, focus)
+
+    def _render(self, size, focus=False):
+        old, new = self.getCanvases(size)
         c = urwid.CanvasJoin([(old, None, False, size[0]),
                               (new, None, False, size[0])])
         #c = urwid.CanvasOverlay(new, old, 6, 0)
@@ -46,113 +95,294 @@ class PanTransition(Transition):
         c.pad_trim_left_right(0-offset, 0-(size[0]-offset))
         return c
 
-class TiltTransition(Transition):
+class TiltTransition(BufferedTransition):
     def render(self, size, focus=False):
-        old = self.old.render((size[0], size[1]))
-        new = self.new.render((size[0], size[1]))
+        with stats.timer('TiltTransition.render'):
+            return self._render(size, focus)
+
+    def _render(self, size, focus=False):
+        old, new = self.getCanvases(size)
         c = urwid.CanvasCombine([(old, None, False),
                               (new, None, False)])
         offset = int(size[1] * self.progress)
         c.pad_trim_top_bottom(0-offset, 0-(size[1]-offset))
         return c
 
-class DissolveTransition(Transition):
-    def __init__(self, *args, **kw):
-        super(DissolveTransition, self).__init__(*args, **kw)
-        self._oldbuf = None
-        self._newbuf = None
-        self._cache_size = None
+class DissolveTransition(BufferedTransition):
+    def render(self, size, focus=False):
+        with stats.timer('DissolveTransition.render'):
+            return self._render(size, focus)
 
-    def setTargets(self, old, new):
-        if old != self.old:
-            self._oldbuf = None
-            self._cache_size = None
-        if new != self.new:
-            self._newbuf = None
-            self._cache_size = None
-        super(DissolveTransition, self).setTargets(old, new)
-
-    def _to_buf(self, canvas):
-        buf = []
+    def _render(self, size, focus=False):
+        oldbuf, newbuf = self.getCells(size)
+        table = palette.ATTR_TABLE
+        rgb_table = table.rgb
+        bg_rgb_table = table.bg_rgb
+        props_table = table.props
+        progress = self.progress
+        line_list = []
+        attr_list = []
+        for oldrow, newrow in zip(oldbuf, newbuf):
+            line_text = []
+            line_attrs = []
+            current_attr = [None, 0]
+            current_key = None
+            for (oldid, oldchar), (newid, newchar) in zip(oldrow, newrow):
+                if newchar == ' ':
+                    char = oldchar
+                    charid = oldid
+                    oldrgb = rgb_table[oldid]
+                    newrgb = bg_rgb_table[newid]
+                elif oldchar == ' ':
+                    char = newchar
+                    charid = newid
+                    oldrgb = bg_rgb_table[oldid]
+                    newrgb = rgb_table[newid]
+                else:
+                    if progress >= 0.5:
+                        char = newchar
+                        charid = newid
+                    else:
+                        char = oldchar
+                        charid = oldid
+                    oldrgb = rgb_table[oldid]
+                    newrgb = rgb_table[newid]
+                char = char.encode('utf8')
+                line_text.append(char)
+                rgb = tuple([int(((n-o)*progress)+o)>>4
+                             for o, n in zip(oldrgb, newrgb)])
+                props = props_table[charid]
+                key = (rgb, props)
+                if current_key == key:
+                    current_attr[1] += len(char)
+                else:
+                    if current_attr[0]:
+                        line_attrs.append(tuple(current_attr))
+                    fg = ', '.join(props + ('#%x%x%x' % rgb[:3],))
+                    bg = '#%x%x%x' % rgb[3:]
+                    attr = palette.transient_attr(fg, bg)
+                    current_attr = [attr, len(char)]
+                    current_key = key
+            line_attrs.append(tuple(current_attr))
+            line_list.append(''.join(line_text))
+            attr_list.append(line_attrs)
+        canvas = urwid.TextCanvas(line_list, attr_list)
+        return canvas
+
+class CellGrid(object):
+    """A rendered slide stored as rows which can be cheaply sliced.
+
+    Each row keeps its encoded text, the byte offset at which each
+    column starts (None for the second column of a wide character),
+    and its attribute runs as [start column, end column, attribute id].
+    """
+
+    def __init__(self, canvas):
+        self.rows = []
         for line in canvas.content():
+            texts = []
+            offsets = [0]
+            runs = []
+            col = 0
+            pos = 0
             for (attr, cs, text) in line:
+                attr_id = palette.attr_id(attr)
+                start = col
                 for char in unicode(text, 'utf8'):
-                    buf.append((attr, cs, char))
-        return buf
+                    pos += len(char.encode('utf8'))
+                    width = urwid.util.calc_width(char, 0, len(char))
+                    if width == 0:
+                        # A combining character belongs to the one
+                        # before it.
+                        offsets[-1] = pos
+                        continue
+                    offsets.extend([None] * (width - 1))
+                    offsets.append(pos)
+                    col += width
+                if col == start:
+                    continue
+                if runs and runs[-1][2] == attr_id:
+                    runs[-1][1] = col
+                else:
+                    runs.append([start, col, attr_id])
+                texts.append(text)
+            starts = [r[0] for r in runs]
+            self.rows.append((''.join(texts), offsets, runs, starts))
+
+    def slice(self, y, start, end):
+        """Return the text and (attribute id, length) runs of a row slice.
+
+        A wide character cut by either end of the slice is replaced
+        by spaces.
+        """
+        text, offsets, runs, starts = self.rows[y]
+        first = start
+        while first < end and offsets[first] is None:
+            first += 1
+        if first == end:
+            return ' ' * (end - start), self._pad([], starts, runs,
+                                                  start, end - start, 0)
+        last = end
+        while offsets[last] is None:
+            last -= 1
+        attrs = []
+        i = max(bisect.bisect_right(starts, first) - 1, 0)
+        while i < len(runs) and runs[i][0] < last:
+            run_start = max(runs[i][0], first)
+            run_end = min(runs[i][1], last)
+            if run_end > run_start:
+                attrs.append((runs[i][2],
+                              offsets[run_end] - offsets[run_start]))
+            i += 1
+        lead = first - start
+        trail = end - last
+        attrs = self._pad(attrs, starts, runs, start, lead, 0)
+        attrs = self._pad(attrs, starts, runs, end - 1, trail, len(attrs))
+        return (' ' * lead + text[offsets[first]:offsets[last]] +
+                ' ' * trail), attrs
+
+    def _pad(self, attrs, starts, runs, col, count, index):
+        # Insert count spaces' worth of the attribute at col into
+        # attrs at index.
+        if not count:
+            return attrs
+        attr_id = runs[max(bisect.bisect_right(starts, col) - 1, 0)][2]
+        attrs = list(attrs)
+        if index < len(attrs) and attrs[index][0] == attr_id:
+            attrs[index] = (attr_id, attrs[index][1] + count)
+        elif index > 0 and attrs[index-1][0] == attr_id:
+            attrs[index-1] = (attr_id, attrs[index-1][1] + count)
+        else:
+            attrs.insert(index, (attr_id, count))
+        return attrs
+
+class CompositeTransition(BufferedTransition):
+    """A transition composited from the cell grids of both slides.
+
+    Subclasses describe each row of a frame as a list of segments
+    (grid, start column, end column) taken from the old or new grid,
+    and may map the attributes of each segment with getAttr to blend
+    colors; by default each row is the row of the new slide.  Work per
+    frame is proportional to the number of rows and
+    attribute runs, regardless of the effect.
+    """
+
+    def __init__(self, *args, **kw):
+        super(CompositeTransition, self).__init__(*args, **kw)
+        self._grids = None
+        self._grids_size = None
+
+    def setTargets(self, old, new):
+        self._grids = None
+        self._grids_size = None
+        super(CompositeTransition, self).setTargets(old, new)
+
+    def getGrids(self, size):
+        if self._grids_size != size:
+            old, new = self.getCanvases(size)
+            self._grids = (CellGrid(old), CellGrid(new))
+            self._grids_size = size
+        return self._grids
+
+    def getSegments(self, y, cols, rows, old, new):
+        # By itself, this shows the new slide, like a cut.
+        return [(new, 0, cols)]
+
+    def getAttr(self, grid, attr_id):
+        return palette.ATTR_TABLE.by_id[attr_id]
 
     def render(self, size, focus=False):
-        if self._cache_size != size:
-            old = self.old.render((size[0], size[1]))
-            new = self.new.render((size[0], size[1]))
-            self._oldbuf = self._to_buf(old)
-            self._newbuf = self._to_buf(new)
-            self._cache_size = size
+        with stats.timer('%s.render' % self.__class__.__name__):
+            return self._render(size, focus)
+
+    def _render(self, size, focus=False):
+        cols, rows = size[0], size[1]
+        old, new = self.getGrids(size)
         line_list = []
         attr_list = []
-        line_text = ''
-        line_attrs = []
-        current_attr = [None, 0]
-        current_rgb = None
-        current_props = None
-        background = urwid.AttrSpec('light gray', 'black')
-        for i in range(len(self._oldbuf)):
-            oldattr, oldcs, oldchar = self._oldbuf[i]
-            newattr, newcs, newchar = self._newbuf[i]
-            oldrgb = oldattr.get_rgb_values()
-            newrgb = newattr.get_rgb_values()
-            if None in oldrgb:
-                oldrgb = background.get_rgb_values()
-            if None in newrgb:
-                newrgb = background.get_rgb_values()
-            if newchar == ' ':
-                char = oldchar
-                charattr = oldattr
-                newrgb = newrgb[3:]*2
-            elif oldchar == ' ':
-                char = newchar
-                charattr = newattr
-                oldrgb = oldrgb[3:]*2
-            elif self.progress >= 0.5:
-                char = newchar
-                charattr = newattr
-            else:
-                char = oldchar
-                charattr = oldattr
-            char = char.encode('utf8')
-            line_text += char
-            rgb = []
-            props = []
-            if charattr.bold:
-                props.append('bold')
-            if charattr.underline:
-                props.append('underline')
-            if charattr.standout:
-                props.append('standout')
-            if charattr.blink:
-                props.append('blink')
-            for x in range(len(oldrgb)):
-                rgb.append(int(((newrgb[x]-oldrgb[x])*self.progress)+oldrgb[x])>>4)
-            if current_rgb == rgb and current_props == props:
-                current_attr[1] += len(char)
-            else:
-                if current_attr[0]:
-                    line_attrs.append(tuple(current_attr))
-                fg = ', '.join(props + ['#%x%x%x' % tuple(rgb[:3])])
-                bg = '#%x%x%x' % tuple(rgb[3:])
-                attr = urwid.AttrSpec(fg, bg)
-                current_attr = [attr, len(char)]
-                current_rgb = rgb
-                current_props = props
-            if (i+1) % size[0] == 0:
-                line_attrs.append(tuple(current_attr))
-                current_attr = [None, 0]
-                current_rgb = None
-                line_list.append(line_text)
-                line_text = ''
-                attr_list.append(line_attrs)
-                line_attrs = []
-        canvas = urwid.TextCanvas(line_list, attr_list)
-        return canvas
+        for y in range(rows):
+            line_text = []
+            line_attrs = []
+            for grid, start, end in self.getSegments(y, cols, rows, old, new):
+                if end <= start:
+                    continue
+                text, attrs = grid.slice(y, start, end)
+                line_text.append(text)
+                for attr_id, length in attrs:
+                    line_attrs.append((self.getAttr(grid, attr_id), length))
+            line_list.append(''.join(line_text))
+            attr_list.append(line_attrs)
+        return urwid.TextCanvas(line_list, attr_list, maxcol=cols,
+                                check_width=False)
+
+class WipeTransition(CompositeTransition):
+    """The new slide is uncovered from left to right."""
+
+    def getSegments(self, y, cols, rows, old, new):
+        edge = int(cols * self.progress)
+        return [(new, 0, edge), (old, edge, cols)]
+
+class SlideOverTransition(CompositeTransition):
+    """The new slide slides in from the right over the old one."""
+
+    def getSegments(self, y, cols, rows, old, new):
+        offset = int(cols * self.progress)
+        return [(old, 0, cols-offset), (new, 0, offset)]
+
+class IrisTransition(CompositeTransition):
+    """The new slide appears in a circle growing from the center."""
+
+    def getSegments(self, y, cols, rows, old, new):
+        # Character cells are about twice as tall as they are wide.
+        center_x = cols / 2.0
+        center_y = rows / 2.0
+        radius = math.hypot(center_x, center_y * 2) * self.progress
+        dy = (y + 0.5 - center_y) * 2
+        if abs(dy) >= radius:
+            return [(old, 0, cols)]
+        half = math.sqrt(radius * radius - dy * dy)
+        left = max(0, min(cols, int(round(center_x - half))))
+        right = max(left, min(cols, int(round(center_x + half))))
+        return [(old, 0, left), (new, left, right), (old, right, cols)]
+
+class FadeTransition(CompositeTransition):
+    """The old slide fades to black, then the new slide fades in."""
+
+    levels = 16
+
+    def __init__(self, *args, **kw):
+        super(FadeTransition, self).__init__(*args, **kw)
+        self._level = None
+        self._attrs = {}
+
+    def setProgress(self, progress):
+        super(FadeTransition, self).setProgress(progress)
+        if progress < 0.5:
+            brightness = 1.0 - progress * 2
+        else:
+            brightness = progress * 2 - 1.0
+        level = int(round(brightness * self.levels))
+        if level != self._level:
+            self._level = level
+            self._attrs = {}
+
+    def getSegments(self, y, cols, rows, old, new):
+        if self.progress < 0.5:
+            return [(old, 0, cols)]
+        return [(new, 0, cols)]
+
+    def getAttr(self, grid, attr_id):
+        attr = self._attrs.get(attr_id)
+        if attr is None:
+            table = palette.ATTR_TABLE
+            scale = float(self._level) / self.levels
+            rgb = [int(x * scale) >> 4 for x in table.rgb[attr_id]]
+            fg = ', '.join(table.props[attr_id] +
+                           ('#%x%x%x' % tuple(rgb[:3]),))
+            bg = '#%x%x%x' % tuple(rgb[3:])
+            attr = palette.transient_attr(fg, bg)
+            self._attrs[attr_id] = attr
+        return attr
 
 class CutTransition(Transition):
     def __init__(self, *args, **kw):